@@ -18,6 +18,7 @@ from bad_ids import bad_ids_page
 from onboarding import onboarding_page
 from knowledge_manager import knowledge_manager_page
 from persona_bot import persona_bot_page
+from llm_usage import llm_usage_page
 
 # Sidebar for navigation
 st.sidebar.title("🧰 MiiOS Toolbox")
@@ -35,7 +36,8 @@ page = st.sidebar.radio("Go to", [
     "✍️ goethe",
     "👤 PersonaBot (soon)",
     "🚀 Onboarding (soon)",
-    "📚 Knowledge Now (soon)"
+    "📚 Knowledge Now (soon)",
+    "📈 LLM Usage (admin)"
 ])
 
 # Navigation
@@ -61,6 +63,8 @@ elif page == "🚀 Onboarding (soon)":
     onboarding_page()
 elif page == "📚 Knowledge Now (soon)":
     knowledge_manager_page()
+elif page == "📈 LLM Usage (admin)":
+    llm_usage_page()
 
 # Footer
 st.write("\n\n")
@@ -2,9 +2,62 @@ import streamlit as st
 import pandas as pd
 import json
 import time
-import io
 import matplotlib.pyplot as plt
-from utils.data_utils import generate_coding_schema, classify_review
+from better_data import identify_junk_answers, parse_missing_values
+from utils.data_utils import CLASSIFICATION_MODEL, generate_coding_schema_map_reduce, classify_reviews
+from utils.cache import upload_hash
+from utils.cascade import CONFIDENCE
+from utils.classification_cache import ClassificationCache, schema_hash
+from utils.export import available_formats, download_button
+from utils.jobs import Checkpoint, job_id
+from utils.loader import read_header, read_preview, read_table
+from utils.text_utils import normalize_texts, stratified_sample
+
+# Missing-value codes the junk pre-filter starts with; compared trimmed and case-insensitively
+JUNK_MISSING_VALUES = '-77,-99,k.A.,keine Angabe,n.a.,weiß nicht'
+# Page languages with a trigram model for spotting keyboard mash
+GIBBERISH_LANGUAGES = {'German': 'de', 'English': 'en'}
+
+def results_frame(reviews, classifications, topics):
+    """One row per review with a 0/1 column per topic (empty where classification failed)."""
+    results = []
+    for review, classification in zip(reviews, classifications):
+        if classification is None:
+            result = {topic['id']: None for topic in topics}
+        else:
+            result = {topic['id']: 0 for topic in topics}
+            for relevant_topic in classification['relevant_topics']:
+                result[relevant_topic['id']] = 1
+        result['Review'] = review
+        results.append(result)
+    return pd.DataFrame(results)
+
+def show_topic_shares(results_df, topics):
+    # Calculate the percentage share
+    # Reviews that could not be classified are left out of the shares
+    classified = results_df.drop(columns=['Review']).dropna()
+    topic_counts = classified.sum()
+    topic_percentages = (topic_counts / len(classified)) * 100
+    topic_percentages = topic_percentages.sort_values(ascending=True)
+
+    # Map topic IDs to topic names
+    topic_id_to_name = {row['id']: row['topic'] for row in topics}
+    topic_labels = [topic_id_to_name[topic_id] for topic_id in topic_percentages.index]
+
+    # Display the horizontal bar chart
+    st.write("Percentage Share of Classified Topics:")
+    fig, ax = plt.subplots()
+    topic_percentages.plot(kind='barh', ax=ax)
+    ax.set_xlabel("Percentage (%)")
+    ax.set_ylabel("Topics")
+    ax.set_title("Percentage Share of Classified Topics")
+
+    # Adding text labels to the side
+    ax.set_yticklabels(topic_labels)
+    for i in ax.patches:
+        ax.text(i.get_width() + 0.5, i.get_y() + 0.5, f'{i.get_width():.2f}%', ha='center', va='center')
+
+    st.pyplot(fig)
 
 def auto_code_tool_page():
     st.image("img/autocode.png")
@@ -22,19 +75,18 @@ def auto_code_tool_page():
     uploaded_file = st.file_uploader("Upload a CSV or XLSX file", type=["csv", "xlsx"])
 
     if uploaded_file is not None:
-        if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
-        elif uploaded_file.name.endswith('.xlsx'):
-            df = pd.read_excel(uploaded_file)
+        data_key = upload_hash(uploaded_file, st.session_state)
 
         st.write("First 5 rows of the uploaded DataFrame:")
-        st.write(df.head())
+        st.write(read_preview(uploaded_file, data_key=data_key))
 
-        column_name = st.selectbox("Choose column for coding schema", options=df.columns)
+        column_name = st.selectbox("Choose column for coding schema", options=read_header(uploaded_file, data_key=data_key))
+        # Only the coded column is needed from here on
+        df = read_table(uploaded_file, usecols=[column_name], data_key=data_key)
 
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            sample_size = st.number_input("Select sample size", min_value=1, max_value=len(df), value=20, step=1)
+            sample_size = st.number_input("Select sample size", min_value=1, max_value=max(int(df[column_name].notna().sum()), 1), value=20, step=1)
         with col2:
             num_codes = st.number_input("Select number of codes", min_value=1, max_value=20, value=7, step=1)
         with col3:
@@ -44,12 +96,38 @@ def auto_code_tool_page():
 
         question_text = st.text_input("Input the question from the questionnaire")
 
-        sample_reviews = df[column_name].dropna().sample(n=sample_size).to_list()  # Filter out NaN values
-        reviews_text = "\n\n".join([str(review) for review in sample_reviews])
+        with st.expander("API and classification settings"):
+            # Defaults match the gpt-4o limits of a low usage tier; raise them for higher tiers
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                workers = st.number_input("Parallel requests", min_value=1, max_value=64, value=8, step=1)
+            with col2:
+                requests_per_minute = st.number_input("Requests per minute", min_value=1, value=500, step=50)
+            with col3:
+                tokens_per_minute = st.number_input("Tokens per minute", min_value=1000, value=30_000, step=1000)
+            with col4:
+                token_budget = st.number_input("Tokens per request", min_value=500, value=4000, step=500, help="Reviews are batched into requests of about this size")
+            use_cache = st.checkbox("Reuse earlier classifications of the same answers", value=True)
+            cascade = st.checkbox("Code predictable answers locally (cascade)", help="A nearest-neighbour model trained on the answers gpt-4o coded in this run codes the answers it is confident about; only the rest are sent")
+            if cascade:
+                col1, col2 = st.columns(2)
+                with col1:
+                    seed_size = st.number_input("Answers coded by gpt-4o first", min_value=50, value=500, step=50)
+                with col2:
+                    confidence = st.slider("Local coding confidence", min_value=0.6, max_value=1.0, value=CONFIDENCE, step=0.05)
+            else:
+                seed_size, confidence = 500, CONFIDENCE
+
+        # Same sample on every rerun, stratified by answer length; NaN values are left out
+        sample_reviews = stratified_sample(df[column_name], sample_size)
 
         if st.button("Generate Coding Schema"):
             with st.spinner('Generating coding schema...'):
-                schema_response = generate_coding_schema(reviews_text, num_codes, question_text, temperature, language)
+                # Large samples are split into chunks coded in parallel and merged into one schema
+                schema_response = generate_coding_schema_map_reduce(
+                    sample_reviews, num_codes, question_text, temperature, language,
+                    workers=workers, requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+                )
             
             schema = json.loads(schema_response)
             schema_df = pd.DataFrame(schema['topics'])
@@ -65,84 +143,94 @@ def auto_code_tool_page():
             st.write(st.session_state.schema_df)
 
     if uploaded_file is not None and 'schema_df' in st.session_state:
+        topics = st.session_state.schema_df.to_dict('records')
+        # The job is identified by file, column, schema and model, so a rerun or refresh picks up its checkpoint
+        job = job_id(data_key, column_name, schema_hash(topics), CLASSIFICATION_MODEL)
+        checkpoint = Checkpoint(job)
+        completed = len(checkpoint.load())
+        if completed:
+            st.info(f"Job {job} has {completed} distinct answers classified already; classifying resumes from there without repeating them.")
+            if st.button("Start this job over"):
+                checkpoint.clear()
+                st.session_state.pop('autocode_results', None)
+                st.rerun()
+
+        prefilter = st.checkbox("Code junk answers locally", help="Missing codes, answers without letters (\"-\", \"123\") and keyboard mash get the chosen code without being sent to gpt-4o")
+        if prefilter:
+            col1, col2 = st.columns(2)
+            with col1:
+                junk_missing_values = st.text_input("Junk answer codes", JUNK_MISSING_VALUES, help="Comma-separated answers that always count as junk")
+            with col2:
+                topic_names = {topic['id']: topic['topic'] for topic in topics}
+                topic_ids = list(topic_names)
+                # Default to a catch-all code such as "Sonstige", otherwise the last one
+                catch_all = [i for i, topic_id in enumerate(topic_ids) if str(topic_names[topic_id]).lower().startswith(('sonstig', 'other', 'autre'))]
+                junk_code = st.selectbox("Code for junk answers", options=topic_ids, index=catch_all[0] if catch_all else len(topic_ids) - 1, format_func=lambda topic_id: f"{topic_id}: {topic_names[topic_id]}")
+            if language not in GIBBERISH_LANGUAGES:
+                st.caption(f"There is no keyboard mash model for {language}; only codes and answers without letters are filtered.")
+
         if st.button("Classify Reviews"):
             with st.spinner('Classifying reviews...'):
-                topics = st.session_state.schema_df.to_dict('records')
-                results = []
                 progress_bar = st.progress(0)
                 df_filtered = df[column_name].dropna()  # Filter out NaN values
-                total_reviews = len(df_filtered)
+                junk = pd.Series(False, index=df_filtered.index)
+                if prefilter:
+                    junk = identify_junk_answers(
+                        df_filtered.to_frame(), column_name, parse_missing_values(junk_missing_values), GIBBERISH_LANGUAGES.get(language),
+                    ).astype(bool)
+                    st.write(f"{junk.sum()} junk answers ({normalize_texts(df_filtered[junk]).nunique()} distinct) coded as \"{topic_names[junk_code]}\" locally instead of being sent for classification.")
+                total_reviews = len(df_filtered) - junk.sum()
                 start_time = time.time()
                 time_placeholder = st.empty()
 
-                for idx, review in enumerate(df_filtered):
-                    classification = classify_review(str(review), topics)
-                    result = {topic['id']: 0 for topic in topics}
-                    for relevant_topic in classification['relevant_topics']:
-                        result[relevant_topic['id']] = 1
-                    result['Review'] = review
-                    results.append(result)
-
-                    progress_bar.progress((idx + 1) / total_reviews)
-
-                    elapsed_time = time.time() - start_time
-                    avg_time_per_review = elapsed_time / (idx + 1)
-                    remaining_time = avg_time_per_review * (total_reviews - idx - 1)
+                def show_progress(done, total):
+                    progress_bar.progress(done / total)
+                    remaining_time = (time.time() - start_time) / done * (total - done)
                     time_placeholder.text(f"Estimated remaining time: {int(remaining_time // 60)} minutes and {int(remaining_time % 60)} seconds")
 
-                results_df = pd.DataFrame(results)
-                st.write(results_df)
-                
-                # Calculate the percentage share
-                topic_counts = results_df.drop(columns=['Review']).sum()
-                topic_percentages = (topic_counts / len(results_df)) * 100
-                topic_percentages = topic_percentages.sort_values(ascending=True)
-
-                # Map topic IDs to topic names
-                topic_id_to_name = {row['id']: row['topic'] for row in topics}
-                topic_labels = [topic_id_to_name[topic_id] for topic_id in topic_percentages.index]
-
-                # Display the horizontal bar chart
-                st.write("Percentage Share of Classified Topics:")
-                fig, ax = plt.subplots()
-                topic_percentages.plot(kind='barh', ax=ax)
-                ax.set_xlabel("Percentage (%)")
-                ax.set_ylabel("Topics")
-                ax.set_title("Percentage Share of Classified Topics")
-                
-                # Adding text labels to the side
-                ax.set_yticklabels(topic_labels)
-                for i in ax.patches:
-                    ax.text(i.get_width() + 0.5, i.get_y() + 0.5, f'{i.get_width():.2f}%', ha='center', va='center')
-
-                st.pyplot(fig)
+                # Batches of reviews are classified in parallel within the rate limits
+                classifications, errors, stats = classify_reviews(
+                    df_filtered[~junk],
+                    topics,
+                    token_budget=token_budget,
+                    cache=ClassificationCache() if use_cache else None,
+                    checkpoint=checkpoint,
+                    cascade=cascade,
+                    seed_size=seed_size,
+                    confidence=confidence,
+                    on_progress=show_progress,
+                    workers=workers,
+                    requests_per_minute=requests_per_minute,
+                    tokens_per_minute=tokens_per_minute,
+                )
+                st.write(f"{stats['unique']} distinct answers among {total_reviews} reviews: {stats['resumed']} taken from the job checkpoint, {stats['cached']} from the cache, {stats['local']} coded locally, {stats['sent']} sent for classification.")
+                if stats.get('agreement') is not None:
+                    st.write(f"Local coding on {stats['holdout']} held-out answers coded by gpt-4o: confident on {stats['coverage']:.0%} of them, with the same codes as gpt-4o for {stats['agreement']:.1%} of those.")
+                if junk.any():
+                    coded = iter(classifications)
+                    junk_classification = {'relevant_topics': [{'id': junk_code}]}
+                    classifications = [junk_classification if is_junk else next(coded) for is_junk in junk]
+                if errors:
+                    st.warning(f"{len(errors)} reviews could not be classified and are left empty: {next(iter(errors.values()))}")
+
+                st.session_state.autocode_results = {'job': job, 'topics': topics, 'results_df': results_frame(df_filtered, classifications, topics)}
+
+        results = st.session_state.get('autocode_results')
+        if results is not None and results['job'] == job:
+            st.write(results['results_df'])
+            show_topic_shares(results['results_df'], results['topics'])
 
     custom_var_name = st.text_input("Enter the base name for the columns", st.session_state.custom_var_name)
     st.session_state.custom_var_name = custom_var_name
+    export_format = st.selectbox("Export format", available_formats())
 
-    if 'custom_var_name' in st.session_state and 'results_df' in locals():
+    if 'custom_var_name' in st.session_state and 'autocode_results' in st.session_state:
         custom_var_name = st.session_state.custom_var_name
+        results_df = st.session_state.autocode_results['results_df']
         topic_columns = [col for col in results_df.columns if col != 'Review']
         new_column_names = {col: f"{custom_var_name}r{idx+1}" for idx, col in enumerate(topic_columns)}
-        results_df.rename(columns=new_column_names, inplace=True)
+        results_df = results_df.rename(columns=new_column_names)
 
         st.write(results_df)
 
-        csv = results_df.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="Download CSV",
-            data=csv,
-            file_name='classified_reviews.csv',
-            mime='text/csv',
-        )
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            results_df.to_excel(writer, index=False, sheet_name='Sheet1')
-        excel_data = output.getvalue()
-        st.download_button(
-            label="Download Excel",
-            data=excel_data,
-            file_name='classified_reviews.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        )
\ No newline at end of file
+        download_button("Download Results", {'Sheet1': results_df}, export_format, 'classified_reviews')
@@ -1,6 +1,86 @@
+import os
+import shutil
+import tempfile
 import streamlit as st
 import pandas as pd
-import io
+import numpy as np
+from better_data import DEFAULT_MISSING_VALUES, parse_missing_values, repeat_offender_waves, respondent_fingerprints
+from utils.cache import upload_hash
+from utils.export import available_formats, download_button
+from utils.fingerprints import FingerprintIndex, value_fingerprints
+from utils.loader import iter_chunks, read_header, read_preview
+
+CHUNKSIZE = 100_000
+
+
+def id_hashes(ids):
+    # 64-bit hashes of the trimmed IDs; only Excel's whole-number floats are canonical (123.0 is 123),
+    # case, leading zeros and every digit of long IDs are kept
+    return value_fingerprints(ids, 'id')
+
+def _contains(sorted_hashes, hashes):
+    positions = np.minimum(np.searchsorted(sorted_hashes, hashes), max(len(sorted_hashes) - 1, 0))
+    return sorted_hashes[positions] == hashes if len(sorted_hashes) else np.zeros(len(hashes), dtype=bool)
+
+def _merge(sorted_hashes, new_hashes):
+    # Both parts are sorted, so the stable sort only merges two runs
+    return np.sort(np.concatenate([sorted_hashes, np.unique(new_hashes)]), kind='stable')
+
+def good_id_hashes(cleaned_files, id_column, chunksize=CHUNKSIZE):
+    """Sorted unique hashes of all IDs in the cleaned files, reading only the ID column."""
+    hashes = np.empty(0, dtype=np.uint64)
+    for cleaned_file in cleaned_files:
+        for chunk in iter_chunks(cleaned_file, chunksize, usecols=[id_column], dtype=str):
+            new_hashes = id_hashes(chunk[id_column].dropna())
+            hashes = _merge(hashes, new_hashes[~_contains(hashes, new_hashes)])
+    return hashes
+
+def _append_csv(frame, path):
+    frame.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+def _read_spill(path, chunksize=CHUNKSIZE):
+    if os.path.exists(path):
+        yield from pd.read_csv(path, chunksize=chunksize, dtype=str, keep_default_na=False)
+
+def diff_ids(original_files, good_hashes, id_column, spill_dir, provider_column=None, fingerprint_columns=(), wave=None, collect_fingerprints=False, chunksize=CHUNKSIZE, device_columns=()):
+    """Split the respondents of the original files into good and bad IDs in one streaming pass.
+
+    Good and bad IDs (and IDs seen in earlier waves, if `fingerprint_columns`
+    or `device_columns` are given) are appended to CSV files in `spill_dir` chunk by chunk, so
+    memory stays flat however long the files are. Each ID is reported once.
+    The provider is the value of `provider_column`, or else the file name.
+    Returns the good/bad counts per provider, the number of distinct IDs and,
+    with `collect_fingerprints`, the fingerprints for the fingerprint index.
+    """
+    missing_values = parse_missing_values(DEFAULT_MISSING_VALUES)
+    usecols = list(dict.fromkeys([id_column] + ([provider_column] if provider_column else []) + list(fingerprint_columns) + list(device_columns)))
+    seen = np.empty(0, dtype=np.uint64)
+    counts = {}
+    fingerprints = [np.empty(0, dtype=np.uint64)]
+    for original_file in original_files:
+        for chunk in iter_chunks(original_file, chunksize, usecols=usecols, dtype=str):
+            chunk = chunk[chunk[id_column].notna()]
+            hashes = id_hashes(chunk[id_column])
+            # Keep the first row of every ID, within the chunk and across earlier chunks
+            first = ~pd.Series(hashes).duplicated().to_numpy() & ~_contains(seen, hashes)
+            chunk, hashes = chunk[first], hashes[first]
+            seen = _merge(seen, hashes)
+
+            provider = chunk[provider_column].fillna('') if provider_column else pd.Series(original_file.name, index=chunk.index)
+            ids = pd.DataFrame({id_column: chunk[id_column], 'Provider': provider})
+            good = _contains(good_hashes, hashes)
+            _append_csv(ids[good], os.path.join(spill_dir, 'good.csv'))
+            _append_csv(ids[~good], os.path.join(spill_dir, 'bad.csv'))
+            for name, flags in (('Good IDs', good), ('Bad IDs', ~good)):
+                for key, count in ids.loc[flags, 'Provider'].value_counts().items():
+                    counts.setdefault(key, {'Good IDs': 0, 'Bad IDs': 0})[name] += count
+
+            if fingerprint_columns or device_columns:
+                found = repeat_offender_waves(chunk, list(fingerprint_columns), missing_values, wave=wave, device_columns=list(device_columns))
+                _append_csv(ids[found != ''].assign(**{'Earlier waves': found[found != '']}), os.path.join(spill_dir, 'repeat.csv'))
+                if collect_fingerprints:
+                    fingerprints.append(respondent_fingerprints(chunk, list(fingerprint_columns), missing_values, device_columns=list(device_columns))[1])
+    return counts, len(seen), np.concatenate(fingerprints)
 
 def bad_ids_page():
     st.image("img/badids.jpg")
@@ -10,40 +90,61 @@ def bad_ids_page():
     Bad Ids identifies which survey responses were retained and which were discarded, providing panel providers with a clear report on the IDs of good and bad data used in the final analysis.
     """)
 
-    original_file = st.file_uploader("Upload the original dataset (xlsx)", type="xlsx")
-    cleaned_file = st.file_uploader("Upload the cleaned dataset (xlsx)", type="xlsx")
+    original_files = st.file_uploader("Upload the original dataset(s), e.g. one per panel provider (xlsx or csv)", type=["xlsx", "csv"], accept_multiple_files=True)
+    cleaned_files = st.file_uploader("Upload the cleaned dataset(s) (xlsx or csv)", type=["xlsx", "csv"], accept_multiple_files=True)
 
-    if original_file is not None and cleaned_file is not None:
-        original_df = pd.read_excel(original_file)
-        cleaned_df = pd.read_excel(cleaned_file)
+    if original_files and cleaned_files:
+        for label, files in (("original", original_files), ("cleaned", cleaned_files)):
+            for file in files:
+                with st.expander(f"First 5 rows of the {label} dataset {file.name}"):
+                    st.write(read_preview(file, data_key=upload_hash(file, st.session_state)))
 
-        st.write("First 5 rows of the original dataset:")
-        st.write(original_df.head())
+        header = read_header(original_files[0], data_key=upload_hash(original_files[0], st.session_state))
+        respondent_id_var = st.selectbox("Select the respondent ID variable", options=header)
+        provider_column = st.selectbox("Provider column (leave empty to use the original file names)", options=[None] + header)
 
-        st.write("First 5 rows of the cleaned dataset:")
-        st.write(cleaned_df.head())
+        # Respondents of earlier waves are looked up in the same fingerprint index betterDATA uses
+        fingerprint_columns = st.multiselect("ID columns to look up in earlier waves (each one identifies a respondent)", options=header, default=[respondent_id_var])
+        device_columns = st.multiselect("Device fields to look up in earlier waves (matched only in combination)", options=header)
+        wave = st.text_input("Wave label", original_files[0].name)
+        add_to_index = st.checkbox("Add the original dataset to the fingerprint index")
 
-        respondent_id_var = st.selectbox("Select the respondent ID variable", options=original_df.columns)
+        export_format = st.selectbox("Export format", available_formats())
 
         if st.button("Process"):
-            with st.spinner("Processing IDs..."):
-                good_ids = set(cleaned_df[respondent_id_var])
-                all_ids = set(original_df[respondent_id_var])
-                bad_ids = all_ids - good_ids
-
-                good_ids_df = pd.DataFrame(good_ids, columns=[respondent_id_var])
-                bad_ids_df = pd.DataFrame(bad_ids, columns=[respondent_id_var])
-
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                    good_ids_df.to_excel(writer, index=False, sheet_name='Good IDs')
-                    bad_ids_df.to_excel(writer, index=False, sheet_name='Bad IDs')
-                
-                excel_data = output.getvalue()
-
-                st.download_button(
-                    label="Download IDs Report",
-                    data=excel_data,
-                    file_name='ids_report.xlsx',
-                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                )
\ No newline at end of file
+            needed = [respondent_id_var] + ([provider_column] if provider_column else []) + fingerprint_columns + device_columns
+            for file in original_files + cleaned_files:
+                columns = read_header(file, data_key=upload_hash(file, st.session_state))
+                absent = [col for col in (needed if file in original_files else [respondent_id_var]) if col not in columns]
+                if absent:
+                    st.error(f"{file.name} has no column {', '.join(map(str, absent))}.")
+                    return
+
+            spill_dir = tempfile.mkdtemp(prefix='bad_ids_')
+            try:
+                with st.spinner("Processing IDs..."):
+                    # Only the needed columns are streamed; the cleaned IDs are kept as sorted 64-bit hashes
+                    good_hashes = good_id_hashes(cleaned_files, respondent_id_var)
+                    counts, total, fingerprints = diff_ids(original_files, good_hashes, respondent_id_var, spill_dir, provider_column, fingerprint_columns, wave, add_to_index, device_columns=device_columns)
+
+                summary = pd.DataFrame.from_dict(counts, orient='index', columns=['Good IDs', 'Bad IDs']).rename_axis('Provider').reset_index()
+                st.write(f"IDs in the original data: {total}")
+                st.write(summary)
+                unmatched = len(good_hashes) - int(summary['Good IDs'].sum())
+                if unmatched:
+                    st.warning(f"{unmatched} IDs of the cleaned data are not in the original data.")
+
+                tables = {
+                    'Summary': summary,
+                    'Good IDs': _read_spill(os.path.join(spill_dir, 'good.csv')),
+                    'Bad IDs': _read_spill(os.path.join(spill_dir, 'bad.csv')),
+                }
+                if fingerprint_columns or device_columns:
+                    tables['Repeat IDs'] = _read_spill(os.path.join(spill_dir, 'repeat.csv'))
+                    if add_to_index:
+                        added = FingerprintIndex().add(fingerprints, wave)
+                        st.success(f"Stored {added} fingerprints for wave '{wave}'.")
+
+                download_button("Download IDs Report", tables, export_format, 'ids_report')
+            finally:
+                shutil.rmtree(spill_dir, ignore_errors=True)
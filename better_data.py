@@ -1,53 +1,676 @@
+import ast
+import json
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 import streamlit as st
 import pandas as pd
-import re
-from io import BytesIO
 import matplotlib.pyplot as plt
 import numpy as np
-
-def identify_speeders(df, time_column, time_threshold):
-    speeders = df[time_column] <= time_threshold
-    return speeders.astype(int)
+from utils.loader import iter_chunks, read_header, read_table, reservoir_sample
+from utils.export import available_formats, download_button
+from utils.cache import dataset_cache, params_key, upload_hash
+from utils.fingerprints import MAX_SHARED_DEVICES, FingerprintIndex, answer_fingerprints, row_fingerprints, value_fingerprints
+from utils.text_utils import GIBBERISH_THRESHOLD, lsh_components, minhash_signatures, ngram_scores, normalize_texts, repetitive_texts
+
+DEFAULT_MISSING_VALUES = '-77,-99,np.nan'
+NAN_TOKENS = {'np.nan', 'nan', 'na', 'none', 'null'}
+
+def parse_missing_values(text):
+    """Parse comma-separated missing-value codes as typed on the page, without eval().
+
+    Numbers become ints or floats, np.nan/nan/NA/None stand for empty cells and
+    anything else, quoted or not, is a text code such as k.A.
+    """
+    codes = []
+    for token in text.split(','):
+        token = token.strip()
+        if not token:
+            continue
+        if token.lower() in NAN_TOKENS:
+            codes.append(np.nan)
+            continue
+        try:
+            value = ast.literal_eval(token)
+        except (ValueError, SyntaxError):
+            value = token
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            value = token
+        codes.append(value)
+    return codes
+
+class MissingValues:
+    """Missing-value codes split by type, turned into one boolean mask per column.
+
+    Numeric columns are compared with the numeric codes only; text columns also
+    with the numbers written as text, so "-77" read from a text column is missing
+    too. With a `data_key` every column's mask is computed once per dataset and
+    shared by all checks through the dataset cache.
+    """
+
+    def __init__(self, codes, data_key=None):
+        self.codes = list(codes)
+        self.data_key = data_key
+        self.nan = any(isinstance(code, float) and np.isnan(code) for code in self.codes)
+        self.numbers = [code for code in self.codes if isinstance(code, (int, float, np.number)) and not pd.isna(code)]
+        texts = [code for code in self.codes if isinstance(code, str)]
+        for number in self.numbers:
+            texts.append(str(number))
+            if float(number).is_integer():
+                texts.append(str(int(number)))
+        self.texts = list(dict.fromkeys(texts))
+
+    def _compute(self, values):
+        if pd.api.types.is_numeric_dtype(values):
+            # A few direct comparisons beat isin(), which casts compact columns first
+            array = values.to_numpy(dtype=np.float64, na_value=np.nan) if pd.api.types.is_extension_array_dtype(values) else values.to_numpy()
+            mask = np.zeros(len(values), dtype=bool)
+            for number in self.numbers:
+                mask |= array == number
+        else:
+            mask = values.isin(self.numbers + self.texts).to_numpy(dtype=bool)
+        if self.nan:
+            mask |= values.isna().to_numpy()
+        # Cached masks are shared between checks, so nobody may modify them in place
+        mask.flags.writeable = False
+        return mask
+
+    def column_mask(self, values):
+        if self.data_key is None:
+            return self._compute(values)
+        key = ('missing', self.data_key, params_key(self.codes), values.name)
+        return dataset_cache.get_or_compute(key, lambda: self._compute(values))
+
+    def mask(self, frame):
+        """Boolean array (rows x columns) marking the missing cells of `frame`."""
+        if frame.shape[1] == 0:
+            return np.zeros(frame.shape, dtype=bool)
+        return np.column_stack([self.column_mask(frame[col]) for col in frame.columns])
+
+def _missing_mask(frame, missing_values):
+    # Checks accept plain code lists (saved configurations) as well as MissingValues
+    if not isinstance(missing_values, MissingValues):
+        missing_values = MissingValues(missing_values or [])
+    return missing_values.mask(frame)
+
+def identify_speeders(df, time_column=None, time_threshold=None, missing_values=None, time_columns=None, speed_threshold=2.0, page_medians=None):
+    if time_columns:
+        speeders = relative_speed_index(df, time_columns, missing_values, page_medians) >= speed_threshold
+        return speeders.astype(np.uint8)
+    # Missing codes such as -99 seconds would otherwise always count as speeding
+    missing = _missing_mask(df[[time_column]], missing_values)[:, 0]
+    speeders = (df[time_column] <= time_threshold) & ~missing
+    return speeders.astype(np.uint8)
+
+def valid_times(times, missing_values=None):
+    # Missing codes would otherwise pull down the median the speeder threshold is proposed from
+    missing = _missing_mask(times.to_frame(), missing_values)[:, 0]
+    return pd.to_numeric(times, errors='coerce').where(~missing)
+
+def _timer_block(df, time_columns, missing_values):
+    # One row per page timer, float32 to halve the memory of wide timer exports;
+    # skipped pages (missing codes, empty or zero timers) become NaN
+    block = np.empty((len(time_columns), len(df)), dtype=np.float32)
+    for i, col in enumerate(time_columns):
+        block[i] = valid_times(df[col], missing_values)
+    block[block <= 0] = np.nan
+    return block
+
+def relative_speed_index(df, time_columns, missing_values=None, medians=None, max_factor=3.0, block_size=32):
+    """Relative speed index (Leiner 2019) of every respondent over per-page timers.
+
+    Each page's speed factor is the page median (from `medians`, or over the
+    respondents in `df` who saw the page) divided by the respondent's
+    time, capped at `max_factor` so one page clicked through cannot dominate;
+    the index is the mean over the pages the respondent saw. 1 is typical speed,
+    2 twice as fast as the typical respondent. Respondents without any timed
+    page get NaN. Timers are processed in blocks of `block_size` columns.
+    """
+    totals = np.zeros(len(df))
+    pages = np.zeros(len(df), dtype=np.int64)
+    for start in range(0, len(time_columns), block_size):
+        block = _timer_block(df, time_columns[start:start + block_size], missing_values)
+        with np.errstate(all='ignore'):
+            # A page median only needs its own column, so it is taken from the same block
+            if medians is None:
+                block_medians = np.nanmedian(block, axis=1) if len(df) else np.full(len(block), np.nan)
+            else:
+                block_medians = np.asarray(medians[start:start + len(block)], dtype=np.float32)
+            factors = np.minimum(block_medians[:, None] / block, max_factor)
+        timed = ~np.isnan(factors)
+        totals += np.where(timed, factors, 0).sum(axis=0)
+        pages += timed.sum(axis=0)
+    with np.errstate(all='ignore'):
+        return pd.Series(totals / pages, index=df.index)
 
 def identify_inconsistencies(df, age_column, birth_year_column, missing_values, allowable_difference=1):
     current_year = pd.Timestamp.now().year
-    inconsistencies = df.apply(
-        lambda row: abs(row[age_column] - (current_year - row[birth_year_column])) > allowable_difference 
-                    if row[age_column] not in missing_values and row[birth_year_column] not in missing_values 
-                    else 0,
-        axis=1
-    )
-    return inconsistencies.astype(int)
+    missing = _missing_mask(df[[age_column, birth_year_column]], missing_values).any(axis=1)
+    # Compact integer codes are widened so the year arithmetic cannot overflow
+    age = df[age_column].astype(np.float64)
+    birth_year = df[birth_year_column].astype(np.float64)
+    difference = (age - (current_year - birth_year)).abs()
+    inconsistencies = (difference > allowable_difference) & ~missing
+    return inconsistencies.astype(np.uint8)
 
 def identify_straightliners(df, questions, missing_values):
-    def is_straightliner(row):
-        unique_values = row[~row.isin(missing_values)].nunique()
-        return unique_values == 1
-    straightliners = df[questions].apply(is_straightliner, axis=1)
-    return straightliners.astype(int)
+    answers = df[questions]
+    if answers.shape[1] == 0:
+        return pd.Series(0, index=df.index, dtype=np.uint8)
+    valid = ~_missing_mask(answers, missing_values) & answers.notna().to_numpy()
+    # Factorize all answers at once so every distinct value gets one integer code,
+    # then a row is a straightliner if its valid codes all share the same min and max
+    codes, _ = pd.factorize(answers.to_numpy().ravel())
+    codes = codes.reshape(answers.shape)
+    lowest = np.where(valid, codes, np.iinfo(codes.dtype).max).min(axis=1)
+    highest = np.where(valid, codes, -1).max(axis=1)
+    straightliners = valid.any(axis=1) & (lowest == highest)
+    return pd.Series(straightliners, index=df.index).astype(np.uint8)
 
 def identify_gibberish(df, open_answer_column, missing_values, language='en'):
     if language == 'de':
-        gibberish_pattern = re.compile(r'^[a-zA-ZäöüÄÖÜß]{8,}$')
+        gibberish_pattern = r'^[a-zA-ZäöüÄÖÜß]{8,}$'
     else:
-        gibberish_pattern = re.compile(r'^[a-zA-Z]{8,}$')
-    gibberish = df[open_answer_column].apply(lambda x: bool(gibberish_pattern.match(str(x))) if x not in missing_values else 0)
-    return gibberish.astype(int)
-
-def identify_gibberish_v2(df, open_answer_column, missing_values, language='en'):
-    return identify_gibberish(df, open_answer_column, missing_values, language)
-
-def identify_straightliners_v2(df, questions, missing_values):
-    return identify_straightliners(df, questions, missing_values)
+        gibberish_pattern = r'^[a-zA-Z]{8,}$'
+    answers = df[open_answer_column]
+    # Open answers repeat a lot, so match each distinct answer only once
+    codes, uniques = pd.factorize(answers)
+    matches = pd.Series(uniques, dtype=object).astype(str).str.match(gibberish_pattern).to_numpy(dtype=bool)
+    # Code -1 (NaN) picks the trailing False
+    matches = np.append(matches, False)
+    gibberish = matches[codes] & ~_missing_mask(df[[open_answer_column]], missing_values)[:, 0]
+    return pd.Series(gibberish, index=df.index).astype(np.uint8)
+
+def identify_gibberish_v2(df, open_answer_column, missing_values, language='en', threshold=GIBBERISH_THRESHOLD):
+    # Scores answers with a character trigram model of the language instead of a
+    # regex, so keyboard mash is caught and long real compounds are not; repeated
+    # letters ("xxxxxxxx") look natural to the model and are caught separately
+    answers = df[open_answer_column]
+    codes, uniques = pd.factorize(answers)
+    flagged = np.append((ngram_scores(uniques, language) < threshold) | repetitive_texts(uniques), False)
+    gibberish = flagged[codes] & ~_missing_mask(df[[open_answer_column]], missing_values)[:, 0]
+    return pd.Series(gibberish, index=df.index).astype(np.uint8)
+
+def identify_junk_answers(df, open_answer_column, missing_values, language=None, threshold=GIBBERISH_THRESHOLD):
+    # Answers not worth coding: missing codes (compared trimmed and case-insensitively,
+    # so " K.A." matches k.A.), answers without a single letter such as "-", "???" or
+    # "123", repeated letters ("xxxxxxxx") and, for languages with a trigram model, keyboard mash
+    codes = missing_values.codes if isinstance(missing_values, MissingValues) else list(missing_values or [])
+    codes = [code.strip().lower() if isinstance(code, str) else code for code in codes]
+    answers = df[open_answer_column].astype('string').str.strip()
+    missing = _missing_mask(answers.str.lower().to_frame(), codes)[:, 0]
+    factor_codes, uniques = pd.factorize(answers)
+    no_letters = ~pd.Series(uniques, dtype='string').str.contains(r'[^\W\d_]', regex=True).to_numpy(dtype=bool, na_value=False)
+    junk = np.append(no_letters | repetitive_texts(uniques), False)[factor_codes]
+    if language is not None:
+        gibberish = np.append(ngram_scores(uniques, language) < threshold, False)[factor_codes]
+        junk |= gibberish
+    # Empty cells are missing answers rather than junk unless NaN is one of the codes
+    junk = (junk & answers.notna().to_numpy()) | missing
+    return pd.Series(junk, index=df.index).astype(np.uint8)
+
+def _grid_matrix(df, columns, missing, rows):
+    # Grid items stacked as the rows of one float matrix with a column per respondent;
+    # NaN where an answer is missing or not a number
+    values = np.empty((len(columns), rows.stop - rows.start), dtype=np.float32)
+    for i, col in enumerate(columns):
+        values[i] = pd.to_numeric(df[col].iloc[rows], errors='coerce')
+        values[i, missing[i][rows]] = np.nan
+    return values
+
+def grid_metrics(values, starts):
+    """Straightlining metrics of every respondent in every grid of a stacked answer matrix.
+
+    `values` holds one row per grid item and one column per respondent;
+    `starts` are the first item of each grid. Missing answers (NaN) are
+    skipped, so runs and patterns continue across them. Returns the number of
+    valid answers, the longest run of equal answers, the response standard
+    deviation (IRV) and whether the answers form a diagonal (1-2-3-4) or
+    zig-zag (1-5-1-5) pattern, each as a grids x respondents array.
+    """
+    size = len(values)
+    # Item positions fit 16 bits, which keeps the index arrays small
+    items = np.arange(size, dtype=np.int16 if size < 2**15 else np.int64)[:, None]
+    is_start = np.zeros(size, dtype=bool)
+    is_start[starts] = True
+    grid_start = starts[np.cumsum(is_start) - 1][:, None]
+    valid = ~np.isnan(values)
+
+    # Item of the previous valid answer within the same grid, -1 if there is none
+    last = np.maximum.accumulate(np.where(valid, items, items.dtype.type(-1)), axis=0)
+    last[last < grid_start] = -1
+    previous = np.full_like(last, -1)
+    previous[1:] = last[:-1]
+    previous[is_start] = -1
+    has_previous = valid & (previous >= 0)
+    before_previous = np.where(has_previous, np.take_along_axis(previous, np.maximum(previous, 0), axis=0), -1)
+    has_before_previous = valid & (before_previous >= 0)
+    step = np.where(has_previous, values - np.take_along_axis(values, np.maximum(previous, 0), axis=0), np.nan)
+
+    # Run lengths restart at every valid answer that differs from the one before
+    same = has_previous & (step == 0)
+    count = np.cumsum(same, axis=0)
+    run_start = np.maximum.accumulate(np.where(valid & ~same, count, 0), axis=0)
+    longest_run = np.maximum.reduceat(np.where(valid, count - run_start + 1, 0), starts, axis=0)
+
+    answered = np.add.reduceat(valid, starts, axis=0)
+    filled = np.where(valid, values, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.add.reduceat(filled, starts, axis=0) / answered
+        irv = np.sqrt(np.maximum(np.add.reduceat(filled ** 2, starts, axis=0) / answered - mean ** 2, 0))
+
+    lowest_step = np.minimum.reduceat(np.where(has_previous, step, np.inf), starts, axis=0)
+    highest_step = np.maximum.reduceat(np.where(has_previous, step, -np.inf), starts, axis=0)
+    diagonal = (lowest_step == highest_step) & (lowest_step != 0)
+    two_back = np.take_along_axis(values, np.maximum(before_previous, 0), axis=0)
+    alternating = np.where(has_before_previous, values == two_back, True) & np.where(has_previous, step != 0, True)
+    zigzag = np.logical_and.reduceat(alternating, starts, axis=0)
+    # Too few answers make any sequence look like a pattern
+    pattern = (diagonal | zigzag) & (answered >= 4)
+    return answered, longest_run, irv, pattern
+
+def grid_scores(df, grids, missing_values, longstring_share=0.8, irv_max=0.5, longstring_weight=1.0, irv_weight=1.0, pattern_weight=1.0, min_items=3, block_size=10_000):
+    """Per-respondent straightlining score across grids, from 0 (no grid) to 1 (every grid).
+
+    A grid counts against a respondent through the weighted sum, capped at 1,
+    of three criteria: the longest run of equal answers covers at least
+    `longstring_share` of the answers, the response standard deviation is at
+    most `irv_max`, or the answers form a diagonal or zig-zag pattern. Grids
+    with fewer than `min_items` answers are left out; respondents without any
+    such grid get NaN.
+    """
+    grids = list(grids)
+    # A flat list of columns, as the single-grid API took them, is one grid
+    if not all(isinstance(grid, (list, tuple, pd.Index, np.ndarray)) for grid in grids):
+        grids = [grids]
+    grids = [list(grid) for grid in grids if len(grid)]
+    scores = np.full(len(df), np.nan)
+    if not grids:
+        return pd.Series(scores, index=df.index)
+    columns = [col for grid in grids for col in grid]
+    starts = np.cumsum([0] + [len(grid) for grid in grids[:-1]])
+    # Masks are taken from the whole frame, where they are cached per column
+    missing = [_missing_mask(df[[col]], missing_values)[:, 0] for col in columns]
+    for block_start in range(0, len(df), block_size):
+        rows = slice(block_start, min(block_start + block_size, len(df)))
+        answered, longest_run, irv, pattern = grid_metrics(_grid_matrix(df, columns, missing, rows), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            grid_score = np.minimum(longstring_weight * (longest_run / answered >= longstring_share) + irv_weight * (irv <= irv_max) + pattern_weight * pattern, 1)
+            counted = answered >= min_items
+            scores[rows] = np.where(counted, grid_score, 0).sum(axis=0) / counted.sum(axis=0)
+    return pd.Series(scores, index=df.index)
+
+def identify_straightliners_v2(df, grids=None, missing_values=None, threshold=0.5, questions=None, **settings):
+    # Configurations saved before grids existed hold one list of `questions`, and calls
+    # written for that API pass it positionally; grid_scores takes such a list as one grid
+    if grids is None:
+        grids = [questions or []]
+    straightliners = grid_scores(df, grids, missing_values, **settings) >= threshold
+    return straightliners.astype(np.uint8)
 
 def identify_duplicates(df, columns, missing_values):
-    def is_duplicate(row):
-        for col in columns:
-            if row[col] in missing_values:
-                return 0
-        return 1
-    duplicates = df.duplicated(subset=columns, keep=False) & df.apply(is_duplicate, axis=1).astype(bool)
-    return duplicates.astype(int)
+    missing = _missing_mask(df[columns], missing_values).any(axis=1)
+    duplicates = df.duplicated(subset=columns, keep=False) & ~missing
+    return duplicates.astype(np.uint8)
+
+def _usable_answers(answers, missing_values):
+    normalized = normalize_texts(answers)
+    usable = ~_missing_mask(answers.to_frame(), missing_values)[:, 0] & answers.notna().to_numpy() & (normalized != '').to_numpy()
+    return normalized[usable], usable
+
+def _cluster_labels(roots, usable):
+    # Number clusters of two or more answers from the largest down; -1 marks unmatched respondents
+    sizes = np.bincount(roots, minlength=len(roots))
+    clustered = np.flatnonzero(sizes > 1)
+    rank = np.full(len(sizes), -1)
+    rank[clustered[np.argsort(-sizes[clustered], kind='stable')]] = np.arange(len(clustered))
+    labels = np.full(len(usable), -1)
+    labels[usable] = rank[roots]
+    return labels
+
+def near_duplicate_clusters(df, open_answer_column, missing_values, threshold=0.8):
+    """Cluster number of each respondent whose open answer nearly duplicates another one, else -1.
+
+    Answers are normalized and compared by MinHash signatures of their character
+    trigrams; an LSH index finds candidates, so the cost grows linearly with the
+    number of answers instead of comparing all pairs.
+    """
+    normalized, usable = _usable_answers(df[open_answer_column], missing_values)
+    codes, uniques = pd.factorize(normalized)
+    roots = lsh_components(minhash_signatures(uniques), threshold)[codes]
+    return pd.Series(_cluster_labels(roots, usable), index=df.index)
+
+def identify_near_duplicates(df, open_answer_column, missing_values, threshold=0.8):
+    return (near_duplicate_clusters(df, open_answer_column, missing_values, threshold) >= 0).astype(np.uint8)
+
+def respondent_fingerprints(df, columns, missing_values, open_answer_column=None, device_columns=()):
+    """Fingerprints identifying each respondent across waves.
+
+    Every ID column gives one fingerprint per non-missing value. Device and
+    other identity fields (browser, screen size, ...) are shared by many
+    respondents, so they only give one fingerprint of their combination, for
+    rows where none of them is missing and which at most MAX_SHARED_DEVICES
+    respondents of `df` share. A long enough open answer adds its
+    MinHash band keys. Returns the row position and uint64 key of every fingerprint.
+    """
+    rows, keys = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.uint64)]
+    columns, device_columns = list(columns or []), list(device_columns or [])
+    missing = _missing_mask(df[columns], missing_values)
+    for i, col in enumerate(columns):
+        valid = ~missing[:, i] & df[col].notna().to_numpy()
+        rows.append(np.flatnonzero(valid))
+        keys.append(value_fingerprints(df[col][valid], col))
+    if device_columns:
+        valid = np.flatnonzero(~(_missing_mask(df[device_columns], missing_values) | df[device_columns].isna().to_numpy()).any(axis=1))
+        device_keys = row_fingerprints(df[device_columns].iloc[valid])
+        # A combination many respondents of the same data share (one device field alone, say) identifies nobody
+        counts = pd.Series(device_keys).map(pd.Series(device_keys).value_counts()).to_numpy()
+        rows.append(valid[counts <= MAX_SHARED_DEVICES])
+        keys.append(device_keys[counts <= MAX_SHARED_DEVICES])
+    if open_answer_column:
+        normalized, usable = _usable_answers(df[open_answer_column], missing_values)
+        positions, band_keys = answer_fingerprints(normalized)
+        rows.append(np.repeat(np.flatnonzero(usable)[positions], band_keys.shape[1]))
+        keys.append(band_keys.ravel())
+    return np.concatenate(rows), np.concatenate(keys)
+
+def repeat_offender_waves(df, columns, missing_values, open_answer_column=None, wave=None, index_dir=None, device_columns=()):
+    """Earlier waves each respondent was found in, as a Series of comma-separated labels ('' if none)."""
+    rows, keys = respondent_fingerprints(df, columns, missing_values, open_answer_column, device_columns)
+    owners, waves = FingerprintIndex(index_dir).lookup(keys, exclude_wave=wave)
+    found = pd.Series(waves, dtype=object).groupby(rows[owners]).agg(lambda labels: ', '.join(sorted(set(labels))))
+    labels = np.full(len(df), '', dtype=object)
+    labels[found.index.to_numpy(dtype=np.int64)] = found.to_numpy()
+    return pd.Series(labels, index=df.index)
+
+def identify_repeat_offenders(df, columns, missing_values, open_answer_column=None, wave=None, index_dir=None, index_generation=None, device_columns=()):
+    # `index_generation` is unused here; it only keys cached results to the state of the index
+    rows, keys = respondent_fingerprints(df, columns, missing_values, open_answer_column, device_columns)
+    matched = FingerprintIndex(index_dir).matches(keys, exclude_wave=wave)
+    repeat = np.zeros(len(df), dtype=np.uint8)
+    repeat[rows[matched]] = 1
+    return pd.Series(repeat, index=df.index)
+
+def add_wave_fingerprints(source, columns, missing_values, open_answer_column=None, wave=None, index_dir=None, chunksize=100_000, device_columns=(), **params):
+    """Store the fingerprints of a DataFrame or of a file read chunk by chunk in the index under `wave`."""
+    if isinstance(source, pd.DataFrame):
+        chunks = [source]
+    else:
+        chunks = iter_chunks(source, chunksize, usecols=list(dict.fromkeys(list(columns) + list(device_columns) + ([open_answer_column] if open_answer_column else []))))
+    keys = [respondent_fingerprints(chunk, columns, missing_values, open_answer_column, device_columns)[1] for chunk in chunks]
+    return FingerprintIndex(index_dir).add(np.concatenate(keys) if keys else np.empty(0, dtype=np.uint64), wave)
+
+QUALITY_CHECK_COLUMNS = ['Speeder', 'Inconsistency', 'Straightliner', 'Gibberish', 'Straightliner_v2', 'Gibberish_v2', 'Duplicate', 'Near_Duplicate', 'Repeat_Offender']
+
+# Flag column -> detector; the check parameters are passed to it as keyword arguments
+DETECTORS = {
+    'Speeder': identify_speeders,
+    'Inconsistency': identify_inconsistencies,
+    'Straightliner': identify_straightliners,
+    'Gibberish': identify_gibberish,
+    'Straightliner_v2': identify_straightliners_v2,
+    'Gibberish_v2': identify_gibberish_v2,
+    'Duplicate': identify_duplicates,
+    'Near_Duplicate': identify_near_duplicates,
+    'Repeat_Offender': identify_repeat_offenders,
+}
+
+def _detector_params(params):
+    return {key: value for key, value in params.items() if key != 'weight'}
+
+# Background threads that compute exact flags for the live preview
+_refiner = ThreadPoolExecutor(max_workers=2, thread_name_prefix='betterdata-refine')
+_refining = {}
+_refining_lock = threading.RLock()
+
+def _flags_key(data_key, name, params):
+    return ('flags', data_key, name, params_key(_detector_params(params)))
+
+def _run_cached(df, name, params, data_key):
+    key = _flags_key(data_key, name, params)
+    params = _detector_params(params)
+    if params.get('missing_values') is not None:
+        params['missing_values'] = MissingValues(params['missing_values'], data_key)
+    return dataset_cache.get_or_compute(key, lambda: DETECTORS[name](df, **params))
+
+def run_detector(df, name, params, data_key=None):
+    """Run one check; with a `data_key` identifying the dataset, results are cached per parameter set."""
+    if data_key is None:
+        return DETECTORS[name](df, **_detector_params(params))
+    # Wait for a background run of the same check instead of repeating it
+    with _refining_lock:
+        pending = _refining.get((data_key, name))
+    if pending is not None and pending[0] == _flags_key(data_key, name, params):
+        try:
+            return pending[1].result()
+        except CancelledError:
+            pass
+    return _run_cached(df, name, params, data_key)
+
+def compute_flags(df, checks, data_key=None):
+    """Run the configured checks; `checks` maps a flag column to its detector parameters and weight."""
+    flags = pd.DataFrame(0, index=df.index, columns=QUALITY_CHECK_COLUMNS, dtype=np.uint8)
+    for name, params in checks.items():
+        flags[name] = run_detector(df, name, params, data_key)
+    return flags
+
+LIVE_SAMPLE_SIZE = 20_000
+# Flags of these checks depend on the other respondents, so a sample cannot estimate them
+WHOLE_DATA_CHECKS = {'Duplicate', 'Near_Duplicate'}
+
+def refine_in_background(df, name, params, data_key):
+    """Compute the exact flags of a check into the dataset cache on a worker thread.
+
+    Only the latest parameters of each check are refined; a queued run for
+    parameters that have since changed is cancelled.
+    """
+    key = _flags_key(data_key, name, params)
+    with _refining_lock:
+        current = _refining.get((data_key, name))
+        if current is not None and current[0] == key:
+            return current[1]
+        if current is not None:
+            current[1].cancel()
+        future = _refiner.submit(_run_cached, df, name, params, data_key)
+        _refining[(data_key, name)] = (key, future)
+        # Finished runs live on in the dataset cache; forget them here so they are not kept twice
+        future.add_done_callback(lambda done: _forget_refinement(data_key, name, done))
+        return future
+
+def _forget_refinement(data_key, name, future):
+    with _refining_lock:
+        if _refining.get((data_key, name), (None, None))[1] is future:
+            del _refining[(data_key, name)]
+
+def wilson_interval(successes, trials, z=1.96):
+    if trials == 0:
+        return 0.0, 1.0
+    share = successes / trials
+    center = (share + z**2 / (2 * trials)) / (1 + z**2 / trials)
+    spread = z / (1 + z**2 / trials) * np.sqrt(share * (1 - share) / trials + z**2 / (4 * trials**2))
+    return max(center - spread, 0.0), min(center + spread, 1.0)
+
+def live_count(df, name, params, data_key, sample_size=LIVE_SAMPLE_SIZE):
+    """Number of respondents a check flags, for the live preview: (count, low, high, exact).
+
+    Exact counts come from the cache. Otherwise the exact flags are computed in
+    the background while the count is estimated from a fixed random sample with
+    a 95% Wilson interval; checks in WHOLE_DATA_CHECKS return None until exact.
+    """
+    flags = dataset_cache.get(_flags_key(data_key, name, params))
+    if flags is None and len(df) <= sample_size:
+        flags = run_detector(df, name, params, data_key)
+    if flags is not None:
+        count = int(flags.sum())
+        return count, count, count, True
+    future = refine_in_background(df, name, params, data_key)
+    if future.done():
+        # Raises the error of a failed run, like computing the count directly would
+        count = int(future.result().sum())
+        return count, count, count, True
+    if name in WHOLE_DATA_CHECKS:
+        return None, None, None, False
+    sample = dataset_cache.get_or_compute(('sample', data_key, sample_size), lambda: reservoir_sample([df], sample_size))
+    # The sample is its own dataset, so it must not share the full frame's cached masks
+    sample_key = ('sample_flags', data_key, sample_size) + _flags_key(data_key, name, params)[2:]
+    hits = int(dataset_cache.get_or_compute(sample_key, lambda: run_detector(sample, name, params)).sum())
+    low, high = wilson_interval(hits, len(sample))
+    scale = len(df) / len(sample)
+    return round(hits * scale), int(low * len(df)), int(np.ceil(high * len(df))), False
+
+def live_counter(label, df, name, params, data_key, progressive=True):
+    """Write the live count of a check; estimates refresh every second until the exact count is in."""
+    def show():
+        count, low, high, exact = live_count(df, name, params, data_key)
+        if exact:
+            st.write(f"{label}: {count}")
+        elif count is None:
+            st.write(f"{label}: counting in the background...")
+        else:
+            st.write(f"{label}: ~{count} (95% CI {low}-{high}, exact count in progress)")
+    if not progressive:
+        st.write(f"{label}: {run_detector(df, name, params, data_key).sum()}")
+    elif dataset_cache.get(_flags_key(data_key, name, params)) is not None:
+        show()
+    else:
+        st.experimental_fragment(show, run_every=1)()
+
+def load_uploaded_file(uploaded_file, data_key):
+    return dataset_cache.get_or_compute(('frame', data_key), lambda: read_table(uploaded_file, data_key=data_key))
+
+def flag_matrix(flags):
+    """Compact respondents x checks matrix, one byte per flag, in QUALITY_CHECK_COLUMNS order."""
+    return flags[QUALITY_CHECK_COLUMNS].to_numpy(dtype=np.uint8)
+
+def weight_vector(checks):
+    return np.array([checks[name]['weight'] if name in checks else 0.0 for name in QUALITY_CHECK_COLUMNS])
+
+def compute_score(flags, checks):
+    return pd.Series(flag_matrix(flags) @ weight_vector(checks), index=flags.index)
+
+def _duplicate_keys(chunk, columns, missing_values):
+    # Chunks are read as text and numbers parsed back, so that e.g. "1" and "1.0" still
+    # collide as in identify_duplicates. to_numeric picks ints or floats per chunk, so
+    # numbers are hashed by their float64 text, which is the same in every chunk
+    keys = pd.DataFrame(index=chunk.index)
+    canonical = pd.DataFrame(index=chunk.index)
+    for col in columns:
+        numbers = pd.to_numeric(chunk[col], errors='coerce')
+        keys[col] = numbers.astype(object).where(numbers.notna(), chunk[col])
+        canonical[col] = numbers.astype(np.float64).astype(str).where(numbers.notna(), chunk[col])
+    missing = _missing_mask(keys, missing_values).any(axis=1)
+    return pd.util.hash_pandas_object(canonical, index=False).to_numpy(), missing
+
+def median_chunked(source, column, chunksize=100_000, missing_values=None):
+    times = [valid_times(chunk[column], missing_values).to_numpy() for chunk in iter_chunks(source, chunksize, usecols=[column], dtype=str)]
+    return np.nanmedian(np.concatenate(times))
+
+def prepare_chunked_checks(source, checks, chunksize=100_000):
+    """First pass over `source` for the checks that need the whole file.
+
+    Resolves a speeder threshold of None to half the exact median duration, fixes
+    the page medians of the relative speed index over the whole file and
+    replaces the duplicate and near-duplicate checks with precomputed flags for
+    the whole file.
+    """
+    checks = {name: dict(params) for name, params in checks.items()}
+    speeders = checks.get('Speeder')
+    page_timers = speeders is not None and bool(speeders.get('time_columns'))
+    need_median = speeders is not None and not page_timers and speeders.get('time_threshold') is None
+    need_page_medians = page_timers and speeders.get('page_medians') is None
+    duplicates = checks.get('Duplicate')
+    near_duplicates = checks.get('Near_Duplicate')
+    usecols = set(duplicates['columns']) if duplicates else set()
+    if need_median:
+        usecols.add(speeders['time_column'])
+    if need_page_medians:
+        usecols.update(speeders['time_columns'])
+    if near_duplicates:
+        usecols.add(near_duplicates['open_answer_column'])
+    if not usecols:
+        return checks
+
+    times, hashes, missing, signatures, usable = [], [], [], [], []
+    for chunk in iter_chunks(source, chunksize, usecols=list(usecols), dtype=str):
+        if need_median:
+            times.append(valid_times(chunk[speeders['time_column']], speeders.get('missing_values')).to_numpy())
+        if need_page_medians:
+            # Page medians are taken over every respondent, not per chunk
+            times.append(_timer_block(chunk, speeders['time_columns'], speeders.get('missing_values')))
+        if duplicates:
+            chunk_hashes, chunk_missing = _duplicate_keys(chunk, duplicates['columns'], duplicates['missing_values'])
+            hashes.append(chunk_hashes)
+            missing.append(chunk_missing)
+        if near_duplicates:
+            # Only the fixed-size signatures are kept, not the answers themselves
+            answers = chunk[near_duplicates['open_answer_column']]
+            numbers = pd.to_numeric(answers, errors='coerce')
+            answers = numbers.astype(object).where(numbers.notna(), answers)
+            normalized, chunk_usable = _usable_answers(answers, near_duplicates['missing_values'])
+            signatures.append(minhash_signatures(normalized))
+            usable.append(chunk_usable)
+
+    if need_median:
+        speeders['time_threshold'] = np.nanmedian(np.concatenate(times)) / 2
+    if need_page_medians:
+        with np.errstate(all='ignore'):
+            speeders['page_medians'] = np.nanmedian(np.concatenate(times, axis=1), axis=1).tolist()
+    if duplicates:
+        hashes = np.concatenate(hashes)
+        _, inverse, counts = np.unique(hashes, return_inverse=True, return_counts=True)
+        duplicates['flags'] = ((counts[inverse] > 1) & ~np.concatenate(missing)).astype(np.uint8)
+    if near_duplicates:
+        signatures = np.concatenate(signatures)
+        roots = lsh_components(signatures, near_duplicates.get('threshold', 0.8))
+        near_duplicates['flags'] = (_cluster_labels(roots, np.concatenate(usable)) >= 0).astype(np.uint8)
+    return checks
+
+def _iter_scored_chunks(source, checks, chunksize):
+    offset = 0
+    row_checks = {name: params for name, params in checks.items() if 'flags' not in params}
+    for chunk in iter_chunks(source, chunksize):
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        flags = compute_flags(chunk, row_checks)
+        for name, params in checks.items():
+            if 'flags' in params:
+                flags[name] = params['flags'][offset:offset + len(chunk)]
+        flags = flags.astype(np.uint8)
+        score = compute_score(flags, checks)
+        yield chunk, flags, score
+        offset += len(chunk)
+
+def _append_csv(frame, path, first):
+    frame.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+
+def run_checks_chunked(source, checks, id_column, threshold=None, bad_ids_path=None, chunksize=100_000):
+    """Score a file too large for memory chunk by chunk.
+
+    Returns one compact row per respondent (ID, flags, Score). If `threshold` and
+    `bad_ids_path` are given, rows scoring at or above the threshold are appended
+    to that CSV as each chunk finishes.
+    """
+    checks = prepare_chunked_checks(source, checks, chunksize)
+    results = []
+    first = True
+    for chunk, flags, score in _iter_scored_chunks(source, checks, chunksize):
+        result = flags.assign(Score=score)
+        result.insert(0, id_column, chunk[id_column])
+        results.append(result)
+        if bad_ids_path is not None and threshold is not None:
+            bad = score >= threshold
+            _append_csv(pd.concat([chunk[bad], result.loc[bad, QUALITY_CHECK_COLUMNS + ['Score']]], axis=1), bad_ids_path, first)
+            first = False
+    return pd.concat(results) if results else pd.DataFrame(columns=[id_column] + QUALITY_CHECK_COLUMNS + ['Score'])
+
+def iter_bad_rows_chunked(source, flags, score, threshold, chunksize=100_000):
+    """Yield the full rows scoring at or above `threshold` chunk by chunk; `flags` and `score` are positional arrays."""
+    offset = 0
+    for chunk in iter_chunks(source, chunksize):
+        chunk_flags = flags[offset:offset + len(chunk)]
+        chunk_score = score[offset:offset + len(chunk)]
+        offset += len(chunk)
+        bad = chunk_score >= threshold
+        checks = pd.DataFrame(chunk_flags[bad], columns=QUALITY_CHECK_COLUMNS).assign(Score=chunk_score[bad])
+        yield pd.concat([chunk[bad].reset_index(drop=True), checks], axis=1)
 
 def better_data_page():
     st.image("img/betterdata.jpg")
@@ -58,165 +681,232 @@ def better_data_page():
     """)
 
     uploaded_file = st.file_uploader("Choose an Excel or CSV file", type=["xlsx", "csv"])
+    checks = None
+    large_file = st.checkbox('Large file mode (process the file in chunks)')
+    if large_file:
+        chunksize = st.number_input('Rows per chunk', min_value=1000, value=100_000, step=10_000)
 
     if uploaded_file is not None:
-        if uploaded_file.name.endswith('.xlsx'):
-            df = pd.read_excel(uploaded_file)
+        if large_file:
+            # Only the header and a preview are loaded; the checks stream over the file
+            df = None
+            data_key = None
+            columns = read_header(uploaded_file)
+            st.write("Data Preview:", next(iter_chunks(uploaded_file, chunksize=5)))
         else:
-            df = pd.read_csv(uploaded_file)
-        
-        original_columns = df.columns.tolist()  # Store the original order of columns
-        st.write("Data Preview:", df.head())
+            # Parsed frames and check results are cached by content hash across reruns
+            data_key = upload_hash(uploaded_file, st.session_state)
+            df = load_uploaded_file(uploaded_file, data_key)
+            columns = df.columns.tolist()
+            st.write("Data Preview:", df.head())
+
+        original_columns = list(columns)  # Store the original order of columns
+        checks = {}
 
         st.header('Quality Check Options')
 
-        id_column = st.selectbox('Select ID column', df.columns)
+        id_column = st.selectbox('Select ID column', columns)
         selected_columns = {id_column}
+        # One set of missing-value codes for all checks; each column's mask is computed once
+        missing_values = parse_missing_values(st.text_input('Missing value codes, separated by commas (e.g. -77, -99, np.nan, k.A.)', DEFAULT_MISSING_VALUES))
+        # Big files get sample estimates at once; exact counts are filled in by background threads
+        progressive = df is not None and st.checkbox('Progressive live counts (sample estimates first, exact counts follow)', value=len(df) > LIVE_SAMPLE_SIZE)
 
         check_speeders = st.checkbox('Check Speeders')
         if check_speeders:
-            time_column = st.selectbox('Select time column', df.columns)
-            selected_columns.add(time_column)
-            if time_column:
-                median_time = df[time_column].median()
-                proposed_threshold = median_time / 2
-                time_threshold = st.number_input('Speeder Threshold (in seconds)', value=proposed_threshold)
+            speeder_mode = st.radio('Speeder mode', ['Total duration', 'Page timers (relative speed index)'], horizontal=True)
+            if speeder_mode == 'Total duration':
+                time_column = st.selectbox('Select time column', columns)
+                selected_columns.add(time_column)
+                if time_column:
+                    if df is None:
+                        # Streaming the column takes a full pass over the file, so it is done once per file, column and codes
+                        median_key = ('median', upload_hash(uploaded_file, st.session_state), time_column, params_key(missing_values))
+                        median_time = dataset_cache.get_or_compute(median_key, lambda: median_chunked(uploaded_file, time_column, chunksize, missing_values))
+                    else:
+                        median_time = valid_times(df[time_column], MissingValues(missing_values, data_key)).median()
+                    proposed_threshold = median_time / 2
+                    time_threshold = st.number_input('Speeder Threshold (in seconds)', value=proposed_threshold)
+                    speeders_weight = st.slider('Speeder Weight', min_value=0.0, max_value=3.0, value=1.0)
+                    checks['Speeder'] = {'time_column': time_column, 'time_threshold': time_threshold, 'missing_values': missing_values, 'weight': speeders_weight}
+            else:
+                # Each page is compared with its own median, so rushing through long grids shows up
+                time_columns = st.multiselect('Select page timer columns', columns)
+                selected_columns.update(time_columns)
+                speed_threshold = st.slider('Flag respondents this many times faster than typical (relative speed index)', min_value=1.0, max_value=3.0, value=2.0, step=0.1)
                 speeders_weight = st.slider('Speeder Weight', min_value=0.0, max_value=3.0, value=1.0)
-                num_speeders = identify_speeders(df, time_column, time_threshold).sum()
-                st.write(f"Number of speeders: {num_speeders}")
+                if time_columns:
+                    checks['Speeder'] = {'time_columns': time_columns, 'speed_threshold': speed_threshold, 'missing_values': missing_values, 'weight': speeders_weight}
+            if 'Speeder' in checks and df is not None:
+                live_counter("Number of speeders", df, 'Speeder', checks['Speeder'], data_key, progressive)
 
         check_inconsistencies = st.checkbox('Check Inconsistencies')
         if check_inconsistencies:
-            age_column = st.selectbox('Select age column', df.columns)
-            birth_year_column = st.selectbox('Select birth year column', df.columns)
+            age_column = st.selectbox('Select age column', columns)
+            birth_year_column = st.selectbox('Select birth year column', columns)
             selected_columns.add(age_column)
             selected_columns.add(birth_year_column)
             inconsistencies_weight = st.slider('Inconsistencies Weight', min_value=0.0, max_value=3.0, value=1.0)
-            missing_values_inconsistencies = st.text_input('Enter missing values separated by commas', '-77,-99,np.nan', key='missing_values_inconsistencies')
-            missing_values_inconsistencies = [eval(value.strip()) for value in missing_values_inconsistencies.split(',')]
-            num_inconsistencies = identify_inconsistencies(df, age_column, birth_year_column, missing_values_inconsistencies).sum()
-            st.write(f"Number of inconsistencies: {num_inconsistencies}")
+            checks['Inconsistency'] = {'age_column': age_column, 'birth_year_column': birth_year_column, 'missing_values': missing_values, 'weight': inconsistencies_weight}
+            if df is not None:
+                live_counter("Number of inconsistencies", df, 'Inconsistency', checks['Inconsistency'], data_key, progressive)
 
         check_straightliners = st.checkbox('Check Straightliners')
         if check_straightliners:
-            question_columns = st.multiselect('Select columns for straightliners', df.columns)
+            question_columns = st.multiselect('Select columns for straightliners', columns)
             selected_columns.update(question_columns)
             straightliners_weight = st.slider('Straightliners Weight', min_value=0.0, max_value=3.0, value=1.0)
-            missing_values_straightliners = st.text_input('Enter missing values separated by commas', '-77,-99,np.nan', key='missing_values_straightliners')
-            missing_values_straightliners = [eval(value.strip()) for value in missing_values_straightliners.split(',')]
-            if question_columns:
-                num_straightliners = identify_straightliners(df, question_columns, missing_values_straightliners).sum()
-                st.write(f"Number of straightliners: {num_straightliners}")
+            checks['Straightliner'] = {'questions': question_columns, 'missing_values': missing_values, 'weight': straightliners_weight}
+            if question_columns and df is not None:
+                live_counter("Number of straightliners", df, 'Straightliner', checks['Straightliner'], data_key, progressive)
 
         check_gibberish = st.checkbox('Check Gibberish')
         if check_gibberish:
-            open_answer_column = st.selectbox('Select open answer column', df.columns)
+            open_answer_column = st.selectbox('Select open answer column', columns)
             selected_columns.add(open_answer_column)
             language = st.selectbox('Select language for gibberish detection', ['en', 'de'])
             gibberish_weight = st.slider('Gibberish Weight', min_value=0.0, max_value=3.0, value=1.0)
-            missing_values_gibberish = st.text_input('Enter missing values separated by commas', '-77,-99,np.nan', key='missing_values_gibberish')
-            missing_values_gibberish = [eval(value.strip()) for value in missing_values_gibberish.split(',')]
-            num_gibberish = identify_gibberish(df, open_answer_column, missing_values_gibberish, language).sum()
-            st.write(f"Number of gibberish answers: {num_gibberish}")
+            checks['Gibberish'] = {'open_answer_column': open_answer_column, 'missing_values': missing_values, 'language': language, 'weight': gibberish_weight}
+            if df is not None:
+                live_counter("Number of gibberish answers", df, 'Gibberish', checks['Gibberish'], data_key, progressive)
 
-        check_straightliners_v2 = st.checkbox('Check Straightliners v2')
+        check_straightliners_v2 = st.checkbox('Check Straightliners v2 (several grids)')
         if check_straightliners_v2:
-            question_columns_v2 = st.multiselect('Select columns for straightliners v2', df.columns)
-            selected_columns.update(question_columns_v2)
+            num_grids = st.number_input('Number of grids', min_value=1, max_value=100, value=1)
+            grids = []
+            for i in range(int(num_grids)):
+                grid = st.multiselect(f'Select columns of grid {i + 1}', columns, key=f'grid_{i}')
+                selected_columns.update(grid)
+                if grid:
+                    grids.append(grid)
+            with st.expander('Grid score settings'):
+                longstring_share = st.slider('Flag a grid if the longest run of equal answers covers at least this share of it', min_value=0.5, max_value=1.0, value=0.8, step=0.05)
+                irv_max = st.number_input('Flag a grid if the standard deviation of its answers is at most', min_value=0.0, value=0.5, step=0.1)
+                longstring_weight = st.slider('Longest run weight', min_value=0.0, max_value=1.0, value=1.0)
+                irv_weight = st.slider('Low variance weight', min_value=0.0, max_value=1.0, value=1.0)
+                pattern_weight = st.slider('Diagonal/zig-zag pattern weight', min_value=0.0, max_value=1.0, value=1.0)
+                grid_threshold = st.slider('Flag respondents with a grid score of at least (share of grids)', min_value=0.0, max_value=1.0, value=0.5, step=0.05)
             straightliners_v2_weight = st.slider('Straightliners v2 Weight', min_value=0.0, max_value=3.0, value=1.0)
-            missing_values_straightliners_v2 = st.text_input('Enter missing values separated by commas', '-77,-99,np.nan', key='missing_values_straightliners_v2')
-            missing_values_straightliners_v2 = [eval(value.strip()) for value in missing_values_straightliners_v2.split(',')]
-            if question_columns_v2:
-                num_straightliners_v2 = identify_straightliners_v2(df, question_columns_v2, missing_values_straightliners_v2).sum()
-                st.write(f"Number of straightliners v2: {num_straightliners_v2}")
+            checks['Straightliner_v2'] = {
+                'grids': grids, 'missing_values': missing_values, 'threshold': grid_threshold,
+                'longstring_share': longstring_share, 'irv_max': irv_max,
+                'longstring_weight': longstring_weight, 'irv_weight': irv_weight, 'pattern_weight': pattern_weight,
+                'weight': straightliners_v2_weight,
+            }
+            if grids and df is not None:
+                live_counter("Number of straightliners v2", df, 'Straightliner_v2', checks['Straightliner_v2'], data_key, progressive)
 
         check_gibberish_v2 = st.checkbox('Check Gibberish v2')
         if check_gibberish_v2:
-            open_answer_column_v2 = st.selectbox('Select open answer column v2', df.columns)
+            open_answer_column_v2 = st.selectbox('Select open answer column v2', columns)
             selected_columns.add(open_answer_column_v2)
             language_v2 = st.selectbox('Select language for gibberish detection v2', ['en', 'de'], key='language_v2')
             gibberish_v2_weight = st.slider('Gibberish v2 Weight', min_value=0.0, max_value=3.0, value=1.0)
-            missing_values_gibberish_v2 = st.text_input('Enter missing values separated by commas', '-77,-99,np.nan', key='missing_values_gibberish_v2')
-            missing_values_gibberish_v2 = [eval(value.strip()) for value in missing_values_gibberish_v2.split(',')]
-            num_gibberish_v2 = identify_gibberish_v2(df, open_answer_column_v2, missing_values_gibberish_v2, language_v2).sum()
-            st.write(f"Number of gibberish answers v2: {num_gibberish_v2}")
+            gibberish_v2_threshold = st.slider('Gibberish v2 Threshold (lower flags fewer answers)', min_value=-8.0, max_value=-1.0, value=GIBBERISH_THRESHOLD, step=0.1)
+            checks['Gibberish_v2'] = {'open_answer_column': open_answer_column_v2, 'missing_values': missing_values, 'language': language_v2, 'threshold': gibberish_v2_threshold, 'weight': gibberish_v2_weight}
+            if df is not None:
+                live_counter("Number of gibberish answers v2", df, 'Gibberish_v2', checks['Gibberish_v2'], data_key, progressive)
 
         check_duplicates = st.checkbox('Check Duplicates')
         if check_duplicates:
-            duplicate_columns = st.multiselect('Select columns to check for duplicates', df.columns)
+            duplicate_columns = st.multiselect('Select columns to check for duplicates', columns)
             selected_columns.update(duplicate_columns)
             duplicates_weight = st.slider('Duplicates Weight', min_value=0.0, max_value=3.0, value=1.0)
-            missing_values_duplicates = st.text_input('Enter missing values separated by commas', '-77,-99,np.nan', key='missing_values_duplicates')
-            missing_values_duplicates = [eval(value.strip()) for value in missing_values_duplicates.split(',')]
             if duplicate_columns:
-                num_duplicates = identify_duplicates(df, duplicate_columns, missing_values_duplicates).sum()
-                st.write(f"Number of duplicates: {num_duplicates}")
+                checks['Duplicate'] = {'columns': duplicate_columns, 'missing_values': missing_values, 'weight': duplicates_weight}
+                if df is not None:
+                    live_counter("Number of duplicates", df, 'Duplicate', checks['Duplicate'], data_key, progressive)
+
+        check_near_duplicates = st.checkbox('Check Near-Duplicates')
+        if check_near_duplicates:
+            near_duplicate_column = st.selectbox('Select open answer column for near-duplicates', columns)
+            selected_columns.add(near_duplicate_column)
+            similarity_threshold = st.slider('Near-Duplicate Similarity', min_value=0.5, max_value=1.0, value=0.8, step=0.05)
+            near_duplicates_weight = st.slider('Near-Duplicates Weight', min_value=0.0, max_value=3.0, value=1.0)
+            checks['Near_Duplicate'] = {'open_answer_column': near_duplicate_column, 'missing_values': missing_values, 'threshold': similarity_threshold, 'weight': near_duplicates_weight}
+            if df is not None:
+                live_counter("Number of near-duplicates", df, 'Near_Duplicate', checks['Near_Duplicate'], data_key, progressive)
+                if st.checkbox('Show near-duplicate clusters'):
+                    params = _detector_params(checks['Near_Duplicate'])
+                    clusters = dataset_cache.get_or_compute(('clusters', data_key, params_key(params)), lambda: near_duplicate_clusters(df, **params))
+                    clustered = df.loc[clusters >= 0, [id_column, near_duplicate_column]].assign(Cluster=clusters[clusters >= 0])
+                    st.write(f"Clusters found: {clusters.max() + 1}")
+                    st.dataframe(clustered.sort_values('Cluster', kind='stable'), hide_index=True)
+
+        check_repeat_offenders = st.checkbox('Check Repeat Offenders (respondents seen in earlier waves)')
+        if check_repeat_offenders:
+            fingerprint_columns = st.multiselect('Select ID columns (each one identifies a respondent)', columns, default=[id_column])
+            device_columns = st.multiselect('Select device fields (matched only in combination)', columns, help='Browser, screen size, IP and similar fields are shared by many respondents, so a respondent only matches if all of them match')
+            fingerprint_answer_column = st.selectbox('Select open answer column to fingerprint (optional)', [None] + columns)
+            wave = st.text_input('Wave label', uploaded_file.name)
+            repeat_offenders_weight = st.slider('Repeat Offenders Weight', min_value=0.0, max_value=3.0, value=1.0)
+            selected_columns.update(fingerprint_columns)
+            selected_columns.update(device_columns)
+            if fingerprint_answer_column:
+                selected_columns.add(fingerprint_answer_column)
+            fingerprint_params = {'columns': fingerprint_columns, 'missing_values': missing_values, 'open_answer_column': fingerprint_answer_column, 'wave': wave, 'device_columns': device_columns}
+            if st.button('Add this wave to the fingerprint index'):
+                with st.spinner('Fingerprinting respondents...'):
+                    added = add_wave_fingerprints(uploaded_file if df is None else df, chunksize=chunksize if large_file else 100_000, **fingerprint_params)
+                st.success(f"Stored {added} fingerprints for wave '{wave}'.")
+            index = FingerprintIndex()
+            st.write(f"Fingerprint index: {len(index)} fingerprints from {len(index.waves)} waves")
+            if fingerprint_columns or device_columns or fingerprint_answer_column:
+                checks['Repeat_Offender'] = dict(fingerprint_params, index_generation=index.generation, weight=repeat_offenders_weight)
+                if df is not None:
+                    live_counter("Number of repeat offenders", df, 'Repeat_Offender', checks['Repeat_Offender'], data_key, progressive)
+                    if st.checkbox('Show repeat offenders'):
+                        found = dataset_cache.get_or_compute(('waves', data_key, index.generation, params_key(fingerprint_params)), lambda: repeat_offender_waves(df, **fingerprint_params))
+                        st.dataframe(df.loc[found != '', [id_column]].assign(**{'Earlier waves': found[found != '']}), hide_index=True)
 
         if st.button('Run Check'):
-            total_respondents = len(df)
-            score = pd.Series(0, index=df.index)
-            
-            # Initialize columns for all checks
-            df['Speeder'] = 0
-            df['Inconsistency'] = 0
-            df['Straightliner'] = 0
-            df['Gibberish'] = 0
-            df['Straightliner_v2'] = 0
-            df['Gibberish_v2'] = 0
-            df['Duplicate'] = 0
-
-            if check_speeders:
-                df['Speeder'] = identify_speeders(df, time_column, time_threshold)
-                score += df['Speeder'] * speeders_weight
-
-            if check_inconsistencies:
-                df['Inconsistency'] = identify_inconsistencies(df, age_column, birth_year_column, missing_values_inconsistencies)
-                score += df['Inconsistency'] * inconsistencies_weight
-
-            if check_straightliners:
-                df['Straightliner'] = identify_straightliners(df, question_columns, missing_values_straightliners)
-                score += df['Straightliner'] * straightliners_weight
-
-            if check_gibberish:
-                df['Gibberish'] = identify_gibberish(df, open_answer_column, missing_values_gibberish, language)
-                score += df['Gibberish'] * gibberish_weight
-
-            if check_straightliners_v2:
-                df['Straightliner_v2'] = identify_straightliners_v2(df, question_columns_v2, missing_values_straightliners_v2)
-                score += df['Straightliner_v2'] * straightliners_v2_weight
-
-            if check_gibberish_v2:
-                df['Gibberish_v2'] = identify_gibberish_v2(df, open_answer_column_v2, missing_values_gibberish_v2, language_v2)
-                score += df['Gibberish_v2'] * gibberish_v2_weight
-
-            if check_duplicates:
-                df['Duplicate'] = identify_duplicates(df, duplicate_columns, missing_values_duplicates)
-                score += df['Duplicate'] * duplicates_weight
-
-            df['Score'] = score
-
-            num_respondents_with_mistakes = (score > 0).sum()
+            if df is None:
+                with st.spinner('Checking the file chunk by chunk...'):
+                    flags = run_checks_chunked(uploaded_file, checks, id_column, chunksize=chunksize)
+                ids = flags[id_column].to_numpy()
+            else:
+                flags = compute_flags(df, checks, data_key)
+                ids = df[id_column].to_numpy()
+            flags = flag_matrix(flags)
+            total_respondents = len(flags)
+
+            num_respondents_with_mistakes = np.count_nonzero(flags @ weight_vector(checks) > 0)
             st.write(f"Total Respondents: {total_respondents}")
             st.write(f"Respondents with at least one mistake: {num_respondents_with_mistakes}")
 
+            # Only the flag matrix is kept; weights and threshold are applied to it on every rerun
             st.session_state['df'] = df
+            st.session_state['ids'] = ids
+            st.session_state['flag_matrix'] = flags
+            st.session_state['chunked_source'] = uploaded_file if large_file else None
+            st.session_state['chunksize'] = chunksize if large_file else None
             st.session_state['selected_columns'] = list(selected_columns)
             st.session_state['id_column'] = id_column
             st.session_state['original_columns'] = original_columns
+            st.session_state['check_config'] = {'id_column': id_column, 'checks': checks}
             st.session_state['analysis_done'] = True
 
     if 'analysis_done' in st.session_state and st.session_state['analysis_done']:
         df = st.session_state['df']
+        ids = st.session_state['ids']
+        flags = st.session_state['flag_matrix']
         selected_columns = st.session_state['selected_columns']
         id_column = st.session_state['id_column']
         original_columns = st.session_state['original_columns']
+        check_config = st.session_state['check_config']
+
+        # Moving a weight slider rescores the stored flags without running the checks again
+        if checks is not None and checks.keys() == check_config['checks'].keys():
+            for name, params in checks.items():
+                check_config['checks'][name]['weight'] = params['weight']
+        score = flags @ weight_vector(check_config['checks'])
 
         col1, col2 = st.columns(2)
 
         with col1:
             st.subheader('Score Distribution')
             fig, ax = plt.subplots()
-            ax.hist(df['Score'], bins=20, edgecolor='k')
+            ax.hist(score, bins=20, edgecolor='k')
             ax.set_xlabel('Score')
             ax.set_ylabel('Frequency')
             st.pyplot(fig)
@@ -224,31 +914,36 @@ def better_data_page():
         with col2:
             st.subheader('Score Box Plot')
             fig, ax = plt.subplots()
-            ax.boxplot(df['Score'], vert=False)
+            ax.boxplot(score, vert=False)
             ax.set_xlabel('Score')
             st.pyplot(fig)
 
-        threshold = st.slider('Score Threshold for Flagging Cheaters', min_value=0.0, max_value=float(df['Score'].max()), value=1.0)
+        threshold = st.slider('Score Threshold for Flagging Cheaters', min_value=0.0, max_value=float(score.max()), value=1.0)
 
-        num_affected = (df['Score'] >= threshold).sum()
+        bad = score >= threshold
+        num_affected = np.count_nonzero(bad)
         st.write(f"Number of respondents affected by the threshold: {num_affected}")
-        st.write(f"Number of respondents remaining in the dataset: {len(df) - num_affected}")
+        st.write(f"Number of respondents remaining in the dataset: {len(score) - num_affected}")
 
-        if st.button('Run'):
-            bad_ids = df[df['Score'] >= threshold][id_column].tolist()
-            st.write("Bad IDs:", bad_ids)
+        # The same configuration can be run headless with better_data_batch.py
+        check_config = dict(check_config, threshold=threshold)
+        st.download_button('Download Check Configuration', data=json.dumps(check_config, indent=2), file_name='betterdata_config.json', mime='application/json')
 
-            if bad_ids:
-                quality_check_columns = ['Speeder', 'Inconsistency', 'Straightliner', 'Gibberish', 'Straightliner_v2', 'Gibberish_v2', 'Duplicate', 'Score']
-                columns_order = original_columns + [col for col in quality_check_columns if col not in original_columns]
-                bad_ids_df = df[df[id_column].isin(bad_ids)][columns_order]
+        export_format = st.selectbox('Export format', available_formats())
 
-                # Save to a BytesIO buffer
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                    bad_ids_df.to_excel(writer, index=False)
-                output.seek(0)
+        if st.button('Run'):
+            bad_ids = ids[bad].tolist()
+            st.write("Bad IDs:", bad_ids)
 
-                st.download_button('Download Bad IDs', data=output, file_name='bad_ids.xlsx', mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            if bad_ids and st.session_state.get('chunked_source') is not None:
+                # Stream the flagged rows straight from the source file into the export
+                bad_rows = iter_bad_rows_chunked(st.session_state['chunked_source'], flags, score, threshold, st.session_state['chunksize'])
+                download_button('Download Bad IDs', {'Bad IDs': bad_rows}, export_format, 'bad_ids')
 
+            elif bad_ids:
+                quality_check_columns = QUALITY_CHECK_COLUMNS + ['Score']
+                columns_order = original_columns + [col for col in quality_check_columns if col not in original_columns]
+                checks_df = pd.DataFrame(flags[bad], columns=QUALITY_CHECK_COLUMNS, index=df.index[bad]).assign(Score=score[bad])
+                bad_ids_df = df[bad].assign(**checks_df)[columns_order]
 
+                download_button('Download Bad IDs', {'Bad IDs': bad_ids_df}, export_format, 'bad_ids')
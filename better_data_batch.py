@@ -0,0 +1,106 @@
+"""Run a saved betterDATA check configuration over a directory of survey files.
+
+    python better_data_batch.py betterdata_config.json waves/ results/ --workers 8
+
+The configuration is the JSON downloaded from the betterDATA page. Every file
+is checked in its own worker process with the same detectors the page uses and
+gets a bad-IDs workbook, a per-respondent flag table and a JSON summary.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from better_data import QUALITY_CHECK_COLUMNS, compute_flags, compute_score, run_checks_chunked, valid_times
+from utils.export import export_tables
+from utils.loader import read_table
+
+FILE_TYPES = ('.csv', '.xlsx')
+
+
+def load_config(path):
+    with open(path) as file:
+        return json.load(file)
+
+def _resolve_checks(df, checks):
+    # A speeder threshold left empty defaults to half the median, as on the page
+    checks = {name: dict(params) for name, params in checks.items()}
+    speeders = checks.get('Speeder')
+    if speeders is not None and not speeders.get('time_columns') and speeders.get('time_threshold') is None:
+        speeders['time_threshold'] = valid_times(df[speeders['time_column']], speeders.get('missing_values')).median() / 2
+    return checks
+
+def check_file(path, config, output_dir, chunksize=None):
+    start_time = time.time()
+    # Keep the extension in the prefix so wave1.csv and wave1.xlsx do not overwrite each other
+    stem = os.path.basename(path).replace('.', '_')
+    id_column = config['id_column']
+    threshold = config['threshold']
+    checks = config['checks']
+
+    if chunksize:
+        bad_ids_path = os.path.join(output_dir, f'{stem}_bad_ids.csv')
+        results = run_checks_chunked(path, checks, id_column, threshold, bad_ids_path, chunksize)
+    else:
+        df = read_table(path, sidecar=False)
+        checks = _resolve_checks(df, checks)
+        flags = compute_flags(df, checks)
+        score = compute_score(flags, checks)
+        results = flags.assign(Score=score)
+        results.insert(0, id_column, df[id_column])
+
+        bad_ids_path = os.path.join(output_dir, f'{stem}_bad_ids.xlsx')
+        bad = score >= threshold
+        bad_ids_df = df[bad].assign(**flags[bad], Score=score[bad])
+        export_tables({'Bad IDs': bad_ids_df}, 'Excel', bad_ids_path)
+
+    results.to_csv(os.path.join(output_dir, f'{stem}_flags.csv'), index=False)
+
+    summary = {
+        'file': os.path.basename(path),
+        'respondents': len(results),
+        'respondents_with_mistakes': int((results['Score'] > 0).sum()),
+        'bad_ids': int((results['Score'] >= threshold).sum()),
+        'threshold': threshold,
+        'seconds': round(time.time() - start_time, 2),
+    }
+    for name in QUALITY_CHECK_COLUMNS:
+        if name in checks:
+            summary[name] = int(results[name].sum())
+    with open(os.path.join(output_dir, f'{stem}_summary.json'), 'w') as file:
+        json.dump(summary, file, indent=2)
+    return summary
+
+def run_batch(config, input_dir, output_dir, workers=None, chunksize=None):
+    """Check every CSV/XLSX file in `input_dir` in parallel and return one summary row per file."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = sorted(os.path.join(input_dir, name) for name in os.listdir(input_dir) if name.endswith(FILE_TYPES))
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(check_file, path, config, output_dir, chunksize): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:
+                summary = {'file': os.path.basename(futures[future]), 'error': str(e)}
+            print(summary)
+            summaries.append(summary)
+    summaries = pd.DataFrame(summaries).sort_values('file')
+    summaries.to_csv(os.path.join(output_dir, 'run_summary.csv'), index=False)
+    return summaries
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('config', help='check configuration JSON saved from the betterDATA page')
+    parser.add_argument('input_dir', help='directory with the CSV/XLSX files to check')
+    parser.add_argument('output_dir', help='directory for the bad IDs, flags and summaries')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--chunksize', type=int, default=None, help='process each file in chunks of this many rows')
+    args = parser.parse_args()
+    run_batch(load_config(args.config), args.input_dir, args.output_dir, args.workers, args.chunksize)
+
+if __name__ == '__main__':
+    main()
@@ -4,18 +4,13 @@ import requests
 import json
 import pandas as pd
 import matplotlib.pyplot as plt
-from openai import OpenAI
 from dotenv import load_dotenv
 from datetime import datetime
+from utils import llm
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize OpenAI API client
-OpenAI.api_key = os.getenv('OPENAI_API_KEY')
-
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-
 IMGUR_CLIENT_ID = os.getenv("IMGUR_CLIENT_ID")  # Replace with your Imgur client ID
 
 def upload_image_to_imgur(image_path):
@@ -30,9 +25,9 @@ def upload_image_to_imgur(image_path):
         return None
 
 def process_receipt(image_url, heutiges_datum):
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
+    # The receipt is sent as an image in OpenAI's format, which Claude does not take, so no failover
+    content = llm.chat(
+        [
             {
                 "role": "user",
                 "content": [
@@ -82,13 +77,16 @@ def process_receipt(image_url, heutiges_datum):
                 ],
             }
         ],
+        model=llm.GPT_MODEL,
         max_tokens=4096,
         temperature=0,
-        response_format={"type": "json_object"},
+        json=True,
+        failover=False,
+        tool='expenses_tracker',
     )
 
     # Extract the response content
-    json_string = json.loads(response.choices[0].message.content)
+    json_string = json.loads(content)
     print(json_string)
     data = json_string
     return data
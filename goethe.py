@@ -1,9 +1,5 @@
 import streamlit as st
-import os
-from openai import OpenAI
-
-# Fetch the API key from environment variables
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from utils import llm
 
 def generate_linkedin_post(insight, hashtags, use_emojis, temperature, considerations, style, language, occasion, post_length, link_url, bold_words):
     emoji_text = " Use appropriate emojis." if use_emojis else ""
@@ -25,16 +21,15 @@ def generate_linkedin_post(insight, hashtags, use_emojis, temperature, considera
     Please write in {language}.
     """
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
+    return llm.chat(
+        [
             {"role": "system", "content": "You are an expert in creating LinkedIn posts."},
             {"role": "user", "content": prompt}
         ],
-        temperature=temperature
+        model=llm.GPT_MODEL,
+        temperature=temperature,
+        tool='goethe',
     )
-    
-    return response.choices[0].message.content
 
 
 def goethe_page():
@@ -1,11 +1,12 @@
 import os
 import streamlit as st
 import time
-from openai import OpenAI
+from utils import llm
+from utils.telemetry import record_call
 
 def interview_bot_page():
-    # Set up OpenAI client
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    # Pooled OpenAI client shared by all reruns and sessions
+    client = llm.openai_client()
 
     # Get assistant_id from environment variables
     assistant_id = os.getenv("ASSISTANT_ID")
@@ -66,6 +67,7 @@ def interview_bot_page():
         with assistant_placeholder.chat_message("assistant"):
             with st.spinner("Thinking..."):
                 # Run the assistant
+                started, start = time.time(), time.perf_counter()
                 run = client.beta.threads.runs.create(
                     thread_id=st.session_state.thread_id,
                     assistant_id=assistant_id
@@ -79,6 +81,10 @@ def interview_bot_page():
                         run_id=run.id
                     )
 
+                # Assistant runs bypass the gateway, so their usage is logged here
+                record_call('interview_bot', run.model, started, time.perf_counter() - start,
+                            run.usage.prompt_tokens if run.usage else 0, run.usage.completion_tokens if run.usage else 0)
+
                 # Retrieve the assistant's messages
                 messages = client.beta.threads.messages.list(
                     thread_id=st.session_state.thread_id
@@ -0,0 +1,56 @@
+import time
+import streamlit as st
+import pandas as pd
+from utils.telemetry import TELEMETRY_PATH, read_calls, summarize_calls
+
+PERIODS = {
+    "Last 24 hours": 24 * 3600,
+    "Last 7 days": 7 * 24 * 3600,
+    "Last 30 days": 30 * 24 * 3600,
+    "All time": None,
+}
+
+def llm_usage_page():
+    st.title("📈 LLM Usage")
+
+    st.write("""
+    Every model call of the toolbox is logged with its tool, model, tokens, wall time,
+    time to first byte and retries. Use this page to see where LLM time and money go.
+    """)
+
+    period = st.selectbox("Period", options=list(PERIODS))
+    seconds = PERIODS[period]
+    calls = read_calls(since=None if seconds is None else time.time() - seconds)
+
+    if calls.empty:
+        st.info(f"No model calls logged for this period. The log is kept at {TELEMETRY_PATH}.")
+        return
+
+    summary = summarize_calls(calls)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Calls", f"{len(calls):,}")
+    col2.metric("Tokens", f"{int(summary['prompt_tokens'].sum() + summary['completion_tokens'].sum()):,}")
+    col3.metric("Estimated cost", f"${summary['cost_usd'].sum():,.2f}")
+    col4.metric("Failed calls", f"{calls['error'].notna().mean():.1%}")
+
+    # Latencies are wall times of whole calls, retries and backoff included
+    st.subheader("Per tool")
+    st.dataframe(summary.round(2), use_container_width=True)
+
+    st.subheader("Per tool and model")
+    st.dataframe(summarize_calls(calls, by=['tool', 'model']).round(2), use_container_width=True)
+
+    st.subheader("Tokens per day")
+    daily = calls.assign(
+        day=pd.to_datetime(calls['time'], unit='s').dt.date,
+        tokens=calls['prompt_tokens'] + calls['completion_tokens'],
+    )
+    st.bar_chart(daily.pivot_table(index='day', columns='tool', values='tokens', aggfunc='sum', fill_value=0))
+
+    failed = calls[calls['error'].notna()]
+    if not failed.empty:
+        st.subheader("Recent failed calls")
+        recent = failed.sort_values('time', ascending=False).head(20)
+        st.dataframe(recent.assign(time=pd.to_datetime(recent['time'], unit='s')), use_container_width=True, hide_index=True)
+
+    st.caption(f"Log file: {TELEMETRY_PATH}. Costs are estimates at list prices.")
@@ -4,12 +4,7 @@ import requests
 from bs4 import BeautifulSoup
 import json
 import numpy as np
-from openai import OpenAI
-import os
-
-OpenAI.api_key = os.getenv('OPENAI_API_KEY')
-
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+from utils import llm
 
 def scrape_rewe_lidl():
     supermarkets = [
@@ -130,16 +125,17 @@ def analyze_with_ai(json_data, prompt):
     ai_prompt = f"""Basierend auf diesen Sondernangeboten aus Supermärkten {json_data}, gib mir die Top 25 Angebote für jemanden mit diesem Wunschprofil: 
     {prompt}, Bitte zeige keine Non-Food-Artikel. 
     Antworte im JSON-Format, das die gleiche Struktur wie die Eingabe hat.in JSON format that has the same structure as the input. the key of the dictionairy is "angebote" """
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        response_format={"type": "json_object"},
-        messages=[
+    content = llm.chat(
+        [
             {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
             {"role": "user", "content": ai_prompt}
         ],
+        model=llm.GPT_MODEL,
         temperature=0,
+        json=True,
+        tool='price_scraper',
     )
-    analyzed_data = json.loads(response.choices[0].message.content)
+    analyzed_data = json.loads(content)
     print(analyzed_data)
     return pd.DataFrame(analyzed_data['angebote'])
 
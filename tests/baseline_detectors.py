@@ -0,0 +1,41 @@
+import re
+
+import pandas as pd
+
+# The row-wise betterDATA detectors as they were before the vectorized engine,
+# kept verbatim as the reference for the parity test and the benchmark
+
+
+def identify_inconsistencies(df, age_column, birth_year_column, missing_values, allowable_difference=1):
+    current_year = pd.Timestamp.now().year
+    inconsistencies = df.apply(
+        lambda row: abs(row[age_column] - (current_year - row[birth_year_column])) > allowable_difference 
+                    if row[age_column] not in missing_values and row[birth_year_column] not in missing_values 
+                    else 0,
+        axis=1
+    )
+    return inconsistencies.astype(int)
+
+def identify_straightliners(df, questions, missing_values):
+    def is_straightliner(row):
+        unique_values = row[~row.isin(missing_values)].nunique()
+        return unique_values == 1
+    straightliners = df[questions].apply(is_straightliner, axis=1)
+    return straightliners.astype(int)
+
+def identify_gibberish(df, open_answer_column, missing_values, language='en'):
+    if language == 'de':
+        gibberish_pattern = re.compile(r'^[a-zA-ZäöüÄÖÜß]{8,}$')
+    else:
+        gibberish_pattern = re.compile(r'^[a-zA-Z]{8,}$')
+    gibberish = df[open_answer_column].apply(lambda x: bool(gibberish_pattern.match(str(x))) if x not in missing_values else 0)
+    return gibberish.astype(int)
+
+def identify_duplicates(df, columns, missing_values):
+    def is_duplicate(row):
+        for col in columns:
+            if row[col] in missing_values:
+                return 0
+        return 1
+    duplicates = df.duplicated(subset=columns, keep=False) & df.apply(is_duplicate, axis=1).astype(bool)
+    return duplicates.astype(int)
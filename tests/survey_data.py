@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+WORDS = ['gut', 'schlecht', 'Qualität', 'asdfghjkl', 'qwertzuiop', 'Kundenservice', 'Lieferung', 'teuer', 'Preis', 'ok']
+
+
+def random_survey(rows, seed=0, grid_size=10):
+    """Synthetic survey export with the answer shapes the betterDATA checks see in practice.
+
+    Ages and birth years (some inconsistent), a Likert grid with missing codes
+    and NaN, and open answers mixing words, keyboard mash, umlauts, missing
+    codes and empty cells. Duplicate keys never contain NaN, since the row-wise
+    duplicate check handled NaN keys inconsistently across dtypes.
+    """
+    rng = np.random.default_rng(seed)
+    birth_year = rng.integers(1940, 2006, rows)
+    age = pd.Timestamp.now().year - birth_year + rng.choice([0, 0, 0, 1, -1, 5, 20], rows)
+    age = np.where(rng.random(rows) < 0.05, -99, age)
+    df = pd.DataFrame({'id': np.arange(rows), 'age': age, 'by': birth_year})
+    straight = rng.random(rows) < 0.2
+    base = rng.integers(1, 6, rows)
+    for i in range(grid_size):
+        values = np.where(straight, base, rng.integers(1, 6, rows)).astype(np.float64)
+        values[rng.random(rows) < 0.05] = -77
+        values[rng.random(rows) < 0.03] = np.nan
+        df[f'q{i}'] = values
+    answers = rng.choice(WORDS, rows).astype(object)
+    answers[rng.random(rows) < 0.05] = -99
+    answers[rng.random(rows) < 0.05] = np.nan
+    df['open'] = answers
+    df['email'] = rng.integers(0, rows // 2 + 1, rows)
+    df['device'] = rng.choice(['mobile', 'desktop', 'tablet'], rows)
+    return df
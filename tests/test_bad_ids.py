@@ -0,0 +1,34 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from bad_ids import diff_ids, good_id_hashes, id_hashes
+
+
+def _csv(name, ids):
+    source = io.BytesIO(pd.DataFrame({'id': ids}).to_csv(index=False).encode())
+    source.name = name
+    return source
+
+def test_id_hashes_are_exact():
+    # Neighbouring long panel IDs, leading zeros and case all tell respondents apart
+    distinct = ['12345678901234567', '12345678901234568', '0123', '123', 'AbC', 'abc']
+    assert len(np.unique(id_hashes(pd.Series(distinct)))) == len(distinct)
+
+def test_id_hashes_canonicalize_whole_number_floats():
+    hashes = id_hashes(pd.Series(['123', ' 123 ', '123.0', 123, 123.0], dtype=object))
+    assert len(np.unique(hashes)) == 1
+    assert id_hashes(pd.Series([123.0, np.nan]))[0] == hashes[0]
+
+def test_diff_ids_matches_the_exact_set_difference(tmp_path):
+    original = ['12345678901234567', '12345678901234568', '0123', '123', 'AbC', 'abc', '7']
+    cleaned = ['12345678901234567', '123', 'abc', '7.0']
+    good_hashes = good_id_hashes([_csv('cleaned.csv', cleaned)], 'id', chunksize=2)
+    counts, total, _ = diff_ids([_csv('original.csv', original)], good_hashes, 'id', str(tmp_path), chunksize=3)
+    assert total == len(original)
+    good = pd.read_csv(tmp_path / 'good.csv', dtype=str)['id'].tolist()
+    bad = pd.read_csv(tmp_path / 'bad.csv', dtype=str)['id'].tolist()
+    assert good == ['12345678901234567', '123', 'abc', '7']
+    assert bad == ['12345678901234568', '0123', 'AbC']
+    assert counts == {'original.csv': {'Good IDs': 4, 'Bad IDs': 3}}
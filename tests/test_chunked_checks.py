@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import better_data
+from utils.loader import read_table
+
+MISSING_VALUES = [-77, -99, np.nan]
+
+
+def _duplicate_flags(frame, tmp_path, columns, chunksize):
+    path = tmp_path / 'survey.csv'
+    frame.to_csv(path, index=False)
+    checks = {'Duplicate': {'columns': columns, 'missing_values': MISSING_VALUES, 'weight': 1.0}}
+    in_memory = better_data.compute_flags(read_table(str(path), sidecar=False), checks)['Duplicate'].tolist()
+    chunked = better_data.run_checks_chunked(str(path), checks, 'id', chunksize=chunksize)['Duplicate'].tolist()
+    return in_memory, chunked
+
+def test_duplicates_across_chunks_with_gaps(tmp_path):
+    # The second chunk has an empty cell, so its numbers are read as floats and the first chunk's as ints
+    frame = pd.DataFrame({'id': range(5), 'email': [100, 200, 100, None, 200]})
+    in_memory, chunked = _duplicate_flags(frame, tmp_path, ['email'], chunksize=2)
+    assert in_memory == [1, 1, 1, 0, 1]
+    assert chunked == in_memory
+
+@pytest.mark.parametrize('chunksize', [7, 64])
+@pytest.mark.parametrize('columns', [['code'], ['score'], ['code', 'score', 'email']])
+def test_duplicates_chunked_parity(tmp_path, chunksize, columns):
+    rng = np.random.default_rng(0)
+    rows = 500
+    frame = pd.DataFrame({
+        'id': range(rows),
+        'code': rng.integers(0, 300, rows).astype(object),
+        'score': rng.choice([1.5, 2.0, 3, 4.25, -99], rows).astype(object),
+        'email': rng.choice(['a@x.de', 'b@x.de', 'c@x.de', '7'], rows).astype(object),
+    })
+    for col in ('code', 'score', 'email'):
+        frame.loc[rng.random(rows) < 0.1, col] = None
+    in_memory, chunked = _duplicate_flags(frame, tmp_path, columns, chunksize)
+    assert sum(in_memory) > 0
+    assert chunked == in_memory
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import baseline_detectors as baseline
+import better_data
+from survey_data import random_survey
+
+MISSING_VALUES = [-77, -99, np.nan]
+
+
+@pytest.fixture(scope='module', params=[0, 1, 2])
+def survey(request):
+    return random_survey(3000, seed=request.param)
+
+def _same(new, old):
+    np.testing.assert_array_equal(new.to_numpy().astype(int), old.to_numpy().astype(int))
+
+def test_inconsistencies(survey):
+    _same(
+        better_data.identify_inconsistencies(survey, 'age', 'by', MISSING_VALUES),
+        baseline.identify_inconsistencies(survey, 'age', 'by', MISSING_VALUES),
+    )
+
+def test_straightliners(survey):
+    questions = [f'q{i}' for i in range(10)]
+    _same(
+        better_data.identify_straightliners(survey, questions, MISSING_VALUES),
+        baseline.identify_straightliners(survey, questions, MISSING_VALUES),
+    )
+
+@pytest.mark.parametrize('language', ['en', 'de'])
+def test_gibberish(survey, language):
+    _same(
+        better_data.identify_gibberish(survey, 'open', MISSING_VALUES, language),
+        baseline.identify_gibberish(survey, 'open', MISSING_VALUES, language),
+    )
+
+def test_duplicates(survey):
+    _same(
+        better_data.identify_duplicates(survey, ['email', 'device'], MISSING_VALUES),
+        baseline.identify_duplicates(survey, ['email', 'device'], MISSING_VALUES),
+    )
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from better_data import DEFAULT_MISSING_VALUES, add_wave_fingerprints, parse_missing_values, repeat_offender_waves
+
+MISSING_VALUES = parse_missing_values(DEFAULT_MISSING_VALUES)
+
+
+def _waves(earlier, current, tmp_path):
+    add_wave_fingerprints(pd.DataFrame({'id': earlier}), ['id'], MISSING_VALUES, wave='wave 1', index_dir=str(tmp_path))
+    return repeat_offender_waves(pd.DataFrame({'id': current}), ['id'], MISSING_VALUES, wave='wave 2', index_dir=str(tmp_path)).tolist()
+
+def test_neighbouring_long_ids_do_not_match(tmp_path):
+    assert _waves([12345678901234567], [12345678901234568, 12345678901234567], tmp_path) == ['', 'wave 1']
+
+def test_text_ids_match_exactly(tmp_path):
+    earlier = ['12345678901234567', '0123', 'AbC']
+    current = ['12345678901234568', '123', 'abc', '0123', ' AbC ']
+    assert _waves(earlier, current, tmp_path) == ['', '', '', 'wave 1', 'wave 1']
+
+def test_whole_number_floats_match_ints(tmp_path):
+    # A column with gaps is read as floats in one wave and as integers in another
+    assert _waves([123.0, None], [123, 124], tmp_path) == ['wave 1', '']
@@ -0,0 +1,46 @@
+import datetime
+import io
+import os
+import warnings
+
+import pandas as pd
+import pytest
+
+from utils import loader
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(loader, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(loader, '_unconvertible', set())
+
+def _xlsx(frame):
+    source = io.BytesIO()
+    frame.to_excel(source, index=False)
+    source.name = 'survey.xlsx'
+    return source
+
+def _cells(frame):
+    return {col: [(type(value), value) if value == value else None for value in frame[col]] for col in frame.columns}
+
+def test_sidecar_keeps_text_with_numeric_missing_codes():
+    # Open answers with numeric missing codes, as Excel stores them
+    source = _xlsx(pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'open': ['gut', -99, 'teuer', None],
+        'code': ['0123', 1.5, 'x', -77],
+    }))
+    parsed = loader.read_table(source, data_key='mixed')
+    assert os.path.exists(loader.sidecar_path('mixed'))
+    assert _cells(loader.read_table(source, data_key='mixed')) == _cells(parsed)
+    assert _cells(loader.read_table(source, data_key='mixed', usecols=['open'])) == _cells(parsed[['open']])
+    assert _cells(loader.read_preview(source, nrows=2, data_key='mixed')) == _cells(parsed.head(2))
+
+def test_unconvertible_table_is_not_converted_again():
+    source = _xlsx(pd.DataFrame({'when': ['x', datetime.datetime(2020, 1, 1)], 'id': [1, 2]}))
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        loader.read_table(source, data_key='dates')
+        assert loader.read_table(source, data_key='dates', usecols=['id'])['id'].tolist() == [1, 2]
+    assert len(caught) == 1
+    assert not os.path.exists(loader.sidecar_path('dates'))
@@ -0,0 +1,120 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils import data_utils, llm, telemetry
+from utils.rate_limit import run_concurrent
+
+TOPICS = [{'id': 1, 'topic': 'Price'}, {'id': 2, 'topic': 'Service'}]
+REVIEW = re.compile(r'^\[(\d+)\] (.*)$', re.MULTILINE)
+
+
+def _topics(text):
+    return [topic['id'] for topic in TOPICS if topic['topic'].lower() in text.lower()]
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenAI chat completions: echoes plain prompts and codes batch prompts by keyword.
+
+    The first `server.rate_limited` requests get a 429 with a short retry-after.
+    Batches of several reviews leave their last review out, so it is sent again.
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests += 1
+            rate_limited = self.server.requests <= self.server.rate_limited
+        if rate_limited:
+            self._reply(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}}, {'retry-after': '0.05'})
+            return
+        prompt = body['messages'][-1]['content']
+        reviews = REVIEW.findall(prompt)
+        if reviews:
+            answered = reviews[:-1] if len(reviews) > 1 else reviews
+            results = [{'id': int(review_id), 'relevant_topics': _topics(text)} for review_id, text in answered]
+            content = json.dumps({'results': results})
+        else:
+            content = prompt
+        self._reply(200, {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4, 'total_tokens': (len(prompt) + len(content)) // 4},
+        })
+
+    def _reply(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch, tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.lock, server.requests, server.rate_limited = threading.Lock(), 0, 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv('OPENAI_API_KEY', 'stub')
+    monkeypatch.setattr(llm, 'OPENAI_BASE_URL', f'http://127.0.0.1:{server.server_port}/v1')
+    monkeypatch.setattr(llm, '_clients', {})
+    monkeypatch.setattr(telemetry, 'TELEMETRY_PATH', str(tmp_path / 'llm_calls.jsonl'))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _echo(item):
+    return llm.chat([{'role': 'user', 'content': f'echo {item}'}], max_retries=0, failover=False, tool='test')
+
+def test_run_concurrent_keeps_order_and_retries_429(stub):
+    stub.rate_limited = 3
+    results, errors = run_concurrent(_echo, range(20), workers=4)
+    assert errors == {}
+    assert results == [f'echo {item}' for item in range(20)]
+    assert stub.requests == 23
+    # Each item is logged once, with the 429s it took counted as its retries
+    calls = telemetry.read_calls()
+    assert len(calls) == 20
+    assert calls['retries'].sum() == 3
+    assert calls['error'].isna().all()
+
+def test_run_concurrent_gives_up_after_max_retries(stub):
+    stub.rate_limited = 100
+    results, errors = run_concurrent(_echo, range(2), workers=2, max_retries=1)
+    assert results == [None, None]
+    assert sorted(errors) == [0, 1]
+    assert stub.requests == 4
+    calls = telemetry.read_calls()
+    assert len(calls) == 2
+    assert (calls['error'] == 'RateLimitError').all()
+
+def test_run_concurrent_keeps_requests_per_minute(stub):
+    # A burst of a tenth of the minute's requests, then two per second
+    start = time.monotonic()
+    results, errors = run_concurrent(_echo, range(16), workers=16, requests_per_minute=120)
+    assert errors == {}
+    assert time.monotonic() - start >= 1.8
+
+def test_classify_reviews(stub):
+    stub.rate_limited = 2
+    reviews = ['The price is too high', 'Friendly service', 'the price is too high!', 'Nothing to add', 'Service and price were fine']
+    classifications, errors, stats = data_utils.classify_reviews(reviews, TOPICS, max_batch_size=3)
+    assert errors == {}
+    assert [[topic['id'] for topic in classification['relevant_topics']] for classification in classifications] == [[1], [2], [1], [], [1, 2]]
+    assert stats['unique'] == 4
+    assert stats['sent'] == 4
+    # Batches of three and one, the review left out of the first sent again, and the two 429s
+    assert stub.requests == 5
@@ -0,0 +1,17 @@
+import numpy as np
+
+import better_data
+from survey_data import random_survey
+
+MISSING_VALUES = [-77, -99, np.nan]
+QUESTIONS = [f'q{i}' for i in range(10)]
+
+
+def test_flat_question_list_is_one_grid():
+    # The single-grid API took a flat list of questions as the second positional argument
+    survey = random_survey(500, seed=0)
+    expected = better_data.identify_straightliners_v2(survey, [QUESTIONS], MISSING_VALUES)
+    assert expected.sum() > 0
+    assert better_data.identify_straightliners_v2(survey, QUESTIONS, MISSING_VALUES).equals(expected)
+    assert better_data.identify_straightliners_v2(survey, tuple(QUESTIONS), MISSING_VALUES).equals(expected)
+    assert better_data.identify_straightliners_v2(survey, questions=QUESTIONS, missing_values=MISSING_VALUES).equals(expected)
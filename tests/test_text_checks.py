@@ -0,0 +1,27 @@
+import pandas as pd
+import pytest
+
+import better_data
+from utils.text_utils import repetitive_texts
+
+# Common open answers with a double letter; a double letter is spelling, not mash
+REAL_WORDS = ['good', 'Good!', 'toll', 'nett', 'cool', 'alle', 'need', 'Anna', 'Emma', 'Kaffee', 'Mississippi']
+MASH = ['xxxxxxxx', 'hahahaha', 'aaaa', 'hhhhhhhh', 'lololol']
+
+
+def test_repetitive_texts():
+    assert repetitive_texts(REAL_WORDS + MASH).tolist() == [False] * len(REAL_WORDS) + [True] * len(MASH)
+
+@pytest.mark.parametrize('language', ['en', 'de'])
+def test_gibberish_keeps_real_words(language):
+    df = pd.DataFrame({'open': REAL_WORDS + MASH})
+    flagged = better_data.identify_gibberish_v2(df, 'open', [-99], language)
+    assert flagged.tolist() == [0] * len(REAL_WORDS) + [1] * len(MASH)
+
+@pytest.mark.parametrize('language', [None, 'en', 'de'])
+def test_junk_answers_keep_real_words(language):
+    # Junk answers are coded locally and never reach the LLM, so real answers must not be junk
+    junk = ['xxxxxxxx', 'hahahaha', '???', '123', ' K.A. ']
+    df = pd.DataFrame({'open': REAL_WORDS + junk})
+    flagged = better_data.identify_junk_answers(df, 'open', ['k.A.', -99], language)
+    assert flagged.tolist() == [0] * len(REAL_WORDS) + [1] * len(junk)
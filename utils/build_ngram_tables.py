@@ -0,0 +1,57 @@
+"""Rebuild the character trigram tables in data/ used by identify_gibberish_v2.
+
+    pip install wordfreq
+    python -m utils.build_ngram_tables
+
+The tables are estimated from the wordfreq word frequency lists (data licensed
+CC BY-SA 4.0, https://github.com/rspeer/wordfreq). Words are weighted by the
+square root of their frequency so that common short words do not drown out
+the letter combinations of the long tail.
+"""
+import os
+import re
+
+import numpy as np
+
+from utils.text_utils import NGRAM_DIR
+
+ALPHABETS = {
+    'en': 'abcdefghijklmnopqrstuvwxyz',
+    'de': 'abcdefghijklmnopqrstuvwxyzäöüß',
+}
+SMOOTHING = 0.01
+
+
+def build_table(language, n_words=200_000):
+    from wordfreq import top_n_list, word_frequency
+
+    alphabet = ALPHABETS[language]
+    index = {char: i for i, char in enumerate(alphabet, start=1)}
+    size = len(alphabet) + 1
+    counts = np.zeros((size, size, size))
+    for word in top_n_list(language, n_words):
+        weight = word_frequency(word, language) ** 0.5
+        for part in re.split(f'[^{alphabet}]+', word.lower()):
+            if part:
+                symbols = [0] + [index[char] for char in part] + [0]
+                for a, b, c in zip(symbols, symbols[1:], symbols[2:]):
+                    counts[a, b, c] += weight
+    # Scale to one unit per word so the smoothing constant is independent of the weights
+    counts *= n_words / counts.sum()
+    counts += SMOOTHING
+    log_probs = np.log(counts / counts.sum(axis=2, keepdims=True))
+    return alphabet, log_probs.astype(np.float32).ravel()
+
+def main():
+    os.makedirs(NGRAM_DIR, exist_ok=True)
+    for language in ALPHABETS:
+        alphabet, log_probs = build_table(language)
+        np.savez_compressed(
+            os.path.join(NGRAM_DIR, f'ngrams_{language}.npz'),
+            alphabet=np.array(alphabet),
+            log_probs=log_probs,
+            source=np.array('Derived from wordfreq word frequencies, CC BY-SA 4.0'),
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# On-disk home for sidecar files and other state that should outlive a rerun. It holds a
+# Parquet copy of every uploaded table, bounded by MIIOS_SIDECAR_MB (default 4 GB, least
+# recently used deleted first), the autoCODE classification cache (MIIOS_CLASSIFICATION_CACHE_MB),
+# job checkpoints, the fingerprint index and the LLM call log
+CACHE_DIR = os.getenv('MIIOS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'miios_cache'))
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def upload_hash(uploaded_file, session_state):
+    """Content hash of a Streamlit upload, computed once per upload and kept in the session."""
+    hashes = session_state.setdefault('upload_hashes', {})
+    file_id = getattr(uploaded_file, 'file_id', None) or uploaded_file.name
+    if file_id not in hashes:
+        hashes[file_id] = content_hash(uploaded_file.getvalue())
+    return hashes[file_id]
+
+def params_key(params):
+    # np.nan and other non-JSON values fall back to their string form
+    return json.dumps(params, sort_keys=True, default=str)
+
+def _size_of(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+class LRUCache:
+    """Thread-safe cache that evicts the least recently used entries beyond `max_bytes`.
+
+    Cached values are shared between reruns and sessions, so callers must not modify them.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        size = _size_of(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+_MISSING = object()
+
+dataset_cache = LRUCache(int(os.getenv('MIIOS_CACHE_MB', '2048')) * 2**20)
@@ -0,0 +1,77 @@
+import numpy as np
+
+from utils.text_utils import ngram_vectors
+
+# Share of the neighbours' weighted votes a topic needs for (or against) it before the local code is trusted
+CONFIDENCE = 0.8
+# Cosine similarity the nearest coded answer must reach; answers unlike anything coded go to the LLM
+MIN_SIMILARITY = 0.4
+# The coder keeps dense vectors of its training answers, so their number is capped
+MAX_TRAINING_TEXTS = 5000
+
+
+def _unit_rows(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+class KNNCoder:
+    """k-nearest-neighbour coder over TF-IDF weighted, hashed character n-grams.
+
+    Trained on answers the LLM has coded (a boolean answers x topics matrix),
+    it predicts each topic from the similarity-weighted votes of the `k` most
+    similar coded answers and says which predictions it is confident about.
+    """
+
+    def __init__(self, texts, labels, k=10, dim=4096):
+        self.k = k
+        self.dim = dim
+        counts = ngram_vectors(texts, dim)
+        document_frequency = (counts > 0).sum(axis=0)
+        self.idf = (np.log((1 + len(counts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        # Stored transposed so the rows of the n-grams a block of queries uses can be picked cheaply
+        self.vectors_by_ngram = np.ascontiguousarray(_unit_rows(counts * self.idf).T)
+        self.labels = np.asarray(labels, dtype=np.float32)
+
+    def similarity(self, texts):
+        """Cosine similarity of each text to each training answer, multiplying only over the n-grams the texts contain."""
+        vectors = _unit_rows(ngram_vectors(texts, self.dim) * self.idf)
+        active = np.flatnonzero(vectors.any(axis=0))
+        return vectors[:, active] @ self.vectors_by_ngram[active]
+
+    def predict(self, texts, confidence=CONFIDENCE, min_similarity=MIN_SIMILARITY, block_size=128):
+        """Predicted topics (answers x topics booleans) and whether each prediction is confident."""
+        predictions = np.zeros((len(texts), self.labels.shape[1]), dtype=bool)
+        confident = np.zeros(len(texts), dtype=bool)
+        k = min(self.k, len(self.labels))
+        if k == 0:
+            return predictions, confident
+        for start in range(0, len(texts), block_size):
+            similarity = self.similarity(texts[start:start + block_size])
+            neighbours = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            weights = np.maximum(np.take_along_axis(similarity, neighbours, axis=1), 0)
+            votes = np.einsum('nk,nkt->nt', weights, self.labels[neighbours]) / np.maximum(weights.sum(axis=1, keepdims=True), 1e-12)
+            rows = slice(start, start + len(similarity))
+            predictions[rows] = votes >= 0.5
+            decided = ((votes >= confidence) | (votes <= 1 - confidence)).all(axis=1)
+            confident[rows] = decided & (weights.max(axis=1) >= min_similarity)
+        return predictions, confident
+
+def holdout_agreement(texts, labels, holdout_share=0.2, seed=0, **settings):
+    """How well a KNNCoder trained on the rest predicts a held-out share of coded answers.
+
+    Returns the share of held-out answers it was confident about (coverage) and
+    the share of those whose predicted topics all match the LLM (agreement).
+    """
+    labels = np.asarray(labels, dtype=bool)
+    order = np.random.default_rng(seed).permutation(len(texts))
+    held_out, train = order[:int(len(texts) * holdout_share)], order[int(len(texts) * holdout_share):]
+    if len(held_out) == 0 or len(train) == 0:
+        return {'holdout': 0, 'coverage': None, 'agreement': None}
+    predict_settings = {key: settings.pop(key) for key in ('confidence', 'min_similarity') if key in settings}
+    coder = KNNCoder([texts[i] for i in train], labels[train], **settings)
+    predictions, confident = coder.predict([texts[i] for i in held_out], **predict_settings)
+    matches = (predictions == labels[held_out]).all(axis=1)
+    return {
+        'holdout': len(held_out),
+        'coverage': confident.mean(),
+        'agreement': matches[confident].mean() if confident.any() else None,
+    }
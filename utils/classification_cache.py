@@ -0,0 +1,94 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from utils.cache import CACHE_DIR, content_hash, params_key
+
+CACHE_PATH = os.path.join(CACHE_DIR, 'classifications.sqlite')
+MAX_BYTES = int(os.getenv('MIIOS_CLASSIFICATION_CACHE_MB', '256')) * 2**20
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+
+def schema_hash(topics):
+    """Hash of a coding schema; editing any code or ID starts a fresh set of cache entries."""
+    return content_hash(params_key([[topic['id'], topic['topic']] for topic in topics]).encode())
+
+class ClassificationCache:
+    """Classifications of normalized response texts per schema and model, kept in SQLite across runs.
+
+    Entries remember when they were last used; once the stored results exceed
+    `max_bytes`, the least recently used ones are deleted.
+    """
+
+    def __init__(self, path=None, max_bytes=MAX_BYTES):
+        self.path = path or CACHE_PATH
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS classifications ("
+                "model TEXT, schema TEXT, text TEXT, result TEXT, size INTEGER, used REAL, "
+                "PRIMARY KEY (model, schema, text))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS classifications_used ON classifications (used)")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call, so worker threads and reruns never share one
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get_many(self, texts, schema, model):
+        """Cached results of the given normalized texts, as a dict of the texts found."""
+        texts = list(dict.fromkeys(texts))
+        found = {}
+        with self._connect() as connection:
+            for start in range(0, len(texts), _LOOKUP_BATCH):
+                batch = texts[start:start + _LOOKUP_BATCH]
+                rows = connection.execute(
+                    f"SELECT text, result FROM classifications WHERE model = ? AND schema = ? AND text IN ({','.join('?' * len(batch))})",
+                    [model, schema] + batch,
+                ).fetchall()
+                found.update((text, json.loads(result)) for text, result in rows)
+            connection.executemany(
+                "UPDATE classifications SET used = ? WHERE model = ? AND schema = ? AND text = ?",
+                [(time.time(), model, schema, text) for text in found],
+            )
+        return found
+
+    def put_many(self, results, schema, model):
+        """Store a dict of normalized text -> result and evict old entries beyond the size limit."""
+        now = time.time()
+        rows = []
+        for text, result in results.items():
+            value = json.dumps(result)
+            rows.append((model, schema, text, value, len(text) + len(value), now))
+        with self._connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._evict(connection)
+
+    def _evict(self, connection):
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM classifications").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% of the limit so the next few writes do not each trigger an eviction
+        excess = total - int(self.max_bytes * 0.9)
+        connection.execute(
+            "DELETE FROM classifications WHERE rowid IN (SELECT rowid FROM ("
+            "SELECT rowid, size, SUM(size) OVER (ORDER BY used, rowid ROWS UNBOUNDED PRECEDING) AS freed FROM classifications"
+            ") WHERE freed - size < ?)",
+            (excess,),
+        )
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM classifications")
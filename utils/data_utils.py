@@ -1,17 +1,14 @@
-from openai import OpenAI
 import json
-import os
-import anthropic
+import numpy as np
 from docx import Document
-
-openai_api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=openai_api_key)
-
-anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
-anthropic_client = anthropic.Anthropic(api_key=anthropic_api_key)
+from utils import llm
+from utils.cascade import CONFIDENCE, MAX_TRAINING_TEXTS, MIN_SIMILARITY, KNNCoder, holdout_agreement
+from utils.classification_cache import schema_hash
+from utils.rate_limit import estimate_tokens, pack_batches, run_concurrent
+from utils.text_utils import normalize_texts
 
 # Function to generate coding scheme using OpenAI API
-def generate_coding_schema(reviews_text, num_codes, question_text, temperature, language):
+def generate_coding_schema(reviews_text, num_codes, question_text, temperature, language, max_retries=None):
     prompt = f"""As an expert data analyst, your task is to create a comprehensive coding schema for analyzing open-ended survey responses. The survey question was:
 
 "{question_text}"
@@ -43,52 +40,314 @@ Output your schema in the following JSON format:
 Ensure that your specific codes collectively cover the major themes in the responses, with "Sonstige" capturing any outliers or less common themes."""
 
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        response_format={"type": "json_object"},
-        messages=[
+    # Callers that retry themselves (max_retries=0) want the error rather than another model's answer
+    return llm.chat(
+        [
             {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
             {"role": "user", "content": prompt}
         ],
-        temperature=temperature
+        model=llm.GPT_MODEL,
+        temperature=temperature,
+        json=True,
+        max_retries=max_retries,
+        failover=max_retries is None,
+        tool='autoCODE',
     )
-    
-    return response.choices[0].message.content
 
-def classify_review(review, topics):
+# Responses per map step of the schema generation are packed up to this many prompt tokens
+SCHEMA_CHUNK_TOKENS = 8000
+# Prompt instructions and the schema the model writes back, per call
+SCHEMA_COMPLETION_TOKENS = 800
+
+def merge_coding_schemas(partial_schemas, num_codes, question_text, temperature, language, max_retries=None):
+    """Reduce step: merge the codes found in chunks of the sample into one schema of `num_codes` codes.
+
+    `partial_schemas` are (number of responses, topics) pairs; the response
+    counts tell the model how much weight each partial schema carries.
+    """
+    schemas_text = "\n\n".join(
+        f"Schema {index} (from {count} responses):\n" + "\n".join(f"- {topic.get('code', topic.get('topic'))}" for topic in topics)
+        for index, (count, topics) in enumerate(partial_schemas, start=1)
+    )
+    prompt = f"""As an expert data analyst, your task is to merge several coding schemas into one final coding schema for analyzing open-ended survey responses. The survey question was:
+
+"{question_text}"
+
+Each of the following schemas was developed from a different part of the same sample of responses, with its codes listed from the most to the least frequently mentioned theme:
+
+{schemas_text}
+
+Instructions:
+1. Merge codes that describe the same theme, even if they are worded differently, and drop duplicates.
+2. Create {num_codes - 1} unique codes for specific themes, starting with the theme that is most frequent across all schemas, weighting each schema by its number of responses.
+3. Always include "Sonstige" (Other) as the last code to capture any responses that don't fit into the specific categories.
+4. Each code should be concise yet descriptive, capturing a distinct aspect of the responses.
+5. Assign a numerical ID to each code, starting from 1, with "Sonstige" always being the last ID.
+6. Present your coding schema in {language}.
+
+Output your schema in the following JSON format:
+{{
+    "topics": [
+        {{"id": 1, "code": "Brief description of the most common theme"}},
+        ...
+        {{"id": {num_codes}, "code": "Sonstige"}}
+    ]
+}}"""
+
+    # Callers that retry themselves (max_retries=0) want the error rather than another model's answer
+    return llm.chat(
+        [
+            {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
+            {"role": "user", "content": prompt}
+        ],
+        model=llm.GPT_MODEL,
+        temperature=temperature,
+        json=True,
+        max_retries=max_retries,
+        failover=max_retries is None,
+        tool='autoCODE',
+    )
+
+def generate_coding_schema_map_reduce(reviews, num_codes, question_text, temperature, language, chunk_tokens=SCHEMA_CHUNK_TOKENS, **limits):
+    """Coding schema of a sample too large for one prompt, in about the time of two calls.
+
+    The responses are split into chunks of about `chunk_tokens` prompt tokens,
+    a partial schema is generated for every chunk in parallel (map) and the
+    partial schemas are merged into the final `num_codes` codes (reduce). A
+    sample that fits into one chunk takes a single call as before. Returns
+    the JSON of the schema, like generate_coding_schema.
+    """
+    reviews = [str(review) for review in reviews]
+    chunks = pack_batches(reviews, estimate_tokens, chunk_tokens)
+    if len(chunks) <= 1:
+        return generate_coding_schema("\n\n".join(reviews), num_codes, question_text, temperature, language)
+    partials, errors = run_concurrent(
+        lambda chunk: json.loads(generate_coding_schema("\n\n".join(chunk), num_codes, question_text, temperature, language, max_retries=0))['topics'],
+        chunks,
+        cost=lambda chunk: sum(estimate_tokens(review) for review in chunk) + SCHEMA_COMPLETION_TOKENS,
+        **limits,
+    )
+    partial_schemas = [(len(chunk), topics) for chunk, topics in zip(chunks, partials) if topics]
+    if not partial_schemas:
+        raise next(iter(errors.values()))
+    return merge_coding_schemas(partial_schemas, num_codes, question_text, temperature, language)
+
+# Model of the review classification; cached classifications are kept per model
+CLASSIFICATION_MODEL = llm.GPT_MODEL
+
+# Completion tokens budgeted for the result of one response in a batch
+BATCH_ITEM_COMPLETION_TOKENS = 20
+
+def batch_classification_prompt(reviews, topics):
+    """Prompt classifying several reviews at once; `reviews` are (id, text) pairs."""
     topics_str = ", ".join([f'{topic["id"]}: {topic["topic"]}' for topic in topics])
-    prompt = f"""Based on the following topics: {topics_str}, classify the review below:
-    
-    Review: {review}
-    
-    Respond with the topic IDs that are relevant to this review in JSON format. The JSON format should look like this: {{"relevant_topics": [{{"id": 1}}, {{"id": 2}}]}} if topics with id 1 and 2 are relevant."""
-    
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        response_format={"type": "json_object"},
-        messages=[
+    reviews_str = "\n".join([f"[{review_id}] {' '.join(str(review).split())}" for review_id, review in reviews])
+    return f"""Based on the following topics: {topics_str}, classify each of the reviews below. Every review starts with its ID in square brackets.
+
+{reviews_str}
+
+Respond in JSON format with one entry per review ID, listing the IDs of the topics relevant to that review. The JSON format should look like this: {{"results": [{{"id": 1, "relevant_topics": [1, 2]}}, {{"id": 2, "relevant_topics": [3]}}]}} if topics 1 and 2 are relevant to review 1 and topic 3 to review 2."""
+
+def parse_batch_classification(content, review_ids, topics):
+    """Classifications by review ID, as {'relevant_topics': [{'id': ...}]}, for the well-formed entries of a batch response.
+
+    Entries for unknown reviews are dropped and so are unknown topic IDs;
+    reviews without a valid entry are simply missing from the result.
+    """
+    topic_ids = {str(topic['id']): topic['id'] for topic in topics}
+    review_ids = {str(review_id): review_id for review_id in review_ids}
+    try:
+        entries = json.loads(content)['results']
+    except (ValueError, KeyError, TypeError):
+        return {}
+    classifications = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict) or str(entry.get('id')) not in review_ids or not isinstance(entry.get('relevant_topics'), list):
+            continue
+        relevant = [topic.get('id') if isinstance(topic, dict) else topic for topic in entry['relevant_topics']]
+        relevant = list(dict.fromkeys(topic_ids[str(topic)] for topic in relevant if str(topic) in topic_ids))
+        classifications.setdefault(review_ids[str(entry['id'])], {'relevant_topics': [{'id': topic} for topic in relevant]})
+    return classifications
+
+# Pass max_retries=0 when the caller retries itself, as the concurrent classification in autoCODE does
+def classify_review_batch(reviews, topics, max_retries=None):
+    """Classify (id, text) pairs in one request; reviews the model left out are missing from the result."""
+    prompt = batch_classification_prompt(reviews, topics)
+    # No failover: cached classifications are kept per model
+    content = llm.chat(
+        [
             {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
             {"role": "user", "content": prompt}
         ],
-        temperature=0
+        model=CLASSIFICATION_MODEL,
+        temperature=0,
+        json=True,
+        max_retries=max_retries,
+        failover=False,
+        tool='autoCODE',
     )
-    return json.loads(response.choices[0].message.content)
+    return parse_batch_classification(content, [review_id for review_id, _ in reviews], topics)
 
+def _classify_with_llm(texts, positions, topics, classifications, errors, token_budget, max_batch_size, max_rounds, on_progress, on_classified, **limits):
+    # Fills `classifications` and `errors` for the texts at `positions`, batching and re-queuing as described in
+    # classify_reviews; `on_classified` gets the {position: classification} of every batch as it completes
+    overhead = estimate_tokens(batch_classification_prompt([], topics))
+    item_cost = lambda position: estimate_tokens(f"[{position}] {texts[position]}", BATCH_ITEM_COMPLETION_TOKENS)
+    pending = list(positions)
+    for round_number in range(max_rounds):
+        if not pending:
+            break
+        last_round = round_number == max_rounds - 1
+        batches = pack_batches(pending, item_cost, token_budget - overhead, 1 if last_round else max_batch_size)
+        finished = len(positions) - len(pending)
 
+        def show_progress(done, total):
+            if on_progress:
+                on_progress(finished + round(done / total * len(pending)))
 
-def transcribe_audio_file(audio_file_path):
-    with open(audio_file_path, 'rb') as audio_file:
-        transcription = client.audio.transcriptions.create(
-            file=audio_file,
-            model="whisper-1",
+        results, batch_errors = run_concurrent(
+            lambda batch: classify_review_batch([(position, texts[position]) for position in batch], topics, max_retries=0),
+            batches,
+            cost=lambda batch: overhead + sum(item_cost(position) for position in batch),
+            on_progress=show_progress,
+            on_result=lambda index, result: on_classified(result),
+            **limits,
         )
-    return transcription.text 
+        for batch, result in zip(batches, results):
+            for position, classification in (result or {}).items():
+                classifications[position] = classification
+        for index, error in batch_errors.items():
+            for position in batches[index]:
+                errors[position] = error
+        pending = [position for position in pending if classifications[position] is None and position not in errors]
+    for position in pending:
+        errors[position] = ValueError("The model returned no classification for this review")
+
+def _topic_matrix(classifications, topics):
+    topic_ids = [topic['id'] for topic in topics]
+    labels = np.zeros((len(classifications), len(topic_ids)), dtype=bool)
+    for row, classification in enumerate(classifications):
+        for topic in classification['relevant_topics']:
+            labels[row, topic_ids.index(topic['id'])] = True
+    return labels
+
+def classify_reviews(reviews, topics, token_budget=4000, max_batch_size=50, max_rounds=3, cache=None, checkpoint=None,
+                     cascade=False, seed_size=500, confidence=CONFIDENCE, min_similarity=MIN_SIMILARITY, on_progress=None, **limits):
+    """Classify many reviews with batched requests run by run_concurrent.
+
+    Reviews that are the same after normalization are classified once and the
+    result is copied to all of them; texts already in `cache` (a
+    ClassificationCache) for this schema and model are not sent at all. The
+    rest are packed into batches that keep each request's estimated prompt and
+    completion tokens within `token_budget`, so short answers share a request
+    and the topic list is sent once per batch instead of once per review.
+    Reviews missing from a response are sent again in later rounds; the last
+    round sends them one per request.
+
+    With a `checkpoint` (a jobs.Checkpoint), every completed batch is
+    recorded as it arrives and texts the checkpoint already holds are taken
+    from it, so a rerun after a crash or refresh resumes where the job
+    stopped and a finished job is rebuilt without calling the API. Codes the
+    local coder saved are only taken while `cascade` is on.
+
+    With `cascade`, only a random sample of `seed_size` texts is sent first.
+    A KNNCoder trained on those and the cached classifications codes the
+    remaining texts it is confident about; while many are left uncertain,
+    doubling random samples of them are sent and the coder retrained. Only
+    the texts still uncertain after that are sent.
+    Returns the classifications in input order (None where classification
+    failed), the errors by position and counts of the unique, cached,
+    resumed, sent and locally coded texts, with the local coder's agreement on held-out
+    LLM-coded answers.
+    """
+    reviews = [str(review) for review in reviews]
+    keys = normalize_texts(reviews).tolist()
+    # The first review of every normalized text stands in for all of its copies
+    first = {}
+    for position, key in enumerate(keys):
+        first.setdefault(key, position)
+    representatives = list(first.items())
+    schema = schema_hash(topics)
+    resumed = checkpoint.load() if checkpoint else {}
+    # Local codes are only final while the cascade is on; without it those texts go to the LLM
+    resumed = {key: record for key, record in resumed.items() if key in first and (cascade or record['source'] == 'llm')}
+    cached = cache.get_many([key for key, _ in representatives if key not in resumed], schema, CLASSIFICATION_MODEL) if cache else {}
+    texts = [reviews[position] for key, position in representatives if key not in cached and key not in resumed]
+    text_keys = [key for key, position in representatives if key not in cached and key not in resumed]
+
+    classifications = [None] * len(texts)
+    errors = {}
+
+    def record(found):
+        # Results are stored batch by batch, so an interrupted run keeps everything already paid for
+        # Only LLM codes reach the shared cache; local codes are kept in this job's checkpoint alone
+        found = {text_keys[position]: classification for position, classification in found.items()}
+        if checkpoint:
+            checkpoint.append(found, 'llm')
+        if cache:
+            cache.put_many(found, schema, CLASSIFICATION_MODEL)
+
+    settings = dict(token_budget=token_budget, max_batch_size=max_batch_size, max_rounds=max_rounds, on_classified=record, **limits)
+    stats = {'unique': len(representatives), 'cached': len(cached), 'resumed': len(resumed), 'local': 0}
+
+    def report(offset):
+        return lambda done: on_progress(offset + done, len(texts)) if on_progress else None
+
+    if cascade and len(texts) > seed_size:
+        rng = np.random.default_rng(0)
+        sent = np.sort(rng.permutation(len(texts))[:seed_size])
+        _classify_with_llm(texts, sent, topics, classifications, errors, on_progress=report(0), **settings)
+        # Cached and resumed classifications of the LLM are training answers too
+        known = list(cached.items()) + [(key, item['classification']) for key, item in resumed.items() if item['source'] == 'llm']
+        topic_ids = [topic['id'] for topic in topics]
+        round_size = seed_size
+        while True:
+            coded = [position for position in sent if classifications[position] is not None]
+            train = ([text_keys[position] for position in coded] + [key for key, _ in known])[:MAX_TRAINING_TEXTS]
+            train_labels = _topic_matrix(([classifications[position] for position in coded] + [classification for _, classification in known])[:MAX_TRAINING_TEXTS], topics)
+            rest = np.setdiff1d(np.arange(len(texts)), sent)
+            predictions, confident = KNNCoder(train, train_labels).predict([text_keys[position] for position in rest], confidence, min_similarity)
+            uncertain = rest[~confident]
+            # More coded answers make the coder confident about more of the rest, so while much is
+            # left uncertain a growing random sample of it is coded by the LLM and the coder retrained
+            round_size *= 2
+            if len(uncertain) <= 2 * round_size or len(train) >= MAX_TRAINING_TEXTS:
+                break
+            sample = np.sort(rng.choice(uncertain, round_size, replace=False))
+            _classify_with_llm(texts, sample, topics, classifications, errors, on_progress=report(len(sent)), **settings)
+            sent = np.concatenate([sent, sample])
+        stats.update(holdout_agreement(train, train_labels, confidence=confidence, min_similarity=min_similarity))
+
+        for position, predicted in zip(rest[confident], predictions[confident]):
+            classifications[position] = {'relevant_topics': [{'id': topic_ids[i]} for i in np.flatnonzero(predicted)]}
+        stats['local'] = int(confident.sum())
+        if checkpoint:
+            checkpoint.append({text_keys[position]: classifications[position] for position in rest[confident]}, 'local')
+        _classify_with_llm(texts, uncertain, topics, classifications, errors, on_progress=report(len(sent) + stats['local']), **settings)
+        sent = np.concatenate([sent, uncertain])
+    else:
+        sent = np.arange(len(texts))
+        _classify_with_llm(texts, sent, topics, classifications, errors, on_progress=report(0), **settings)
+    stats['sent'] = len(sent)
+
+    by_key = {**cached, **{key: item['classification'] for key, item in resumed.items()}, **{key: classification for key, classification in zip(text_keys, classifications) if classification is not None}}
+    errors_by_key = {text_keys[position]: error for position, error in errors.items()}
+    return (
+        [by_key.get(key) for key in keys],
+        {position: errors_by_key[key] for position, key in enumerate(keys) if key in errors_by_key},
+        stats,
+    )
+
+
+def transcribe_audio_file(audio_file_path):
+    return llm.transcribe(audio_file_path, tool='whisper')
+
+# Each analysis model fails over to the other one
+ANALYSIS_MODELS = {"GPT-4": llm.GPT_MODEL, "Claude": llm.CLAUDE_MODEL}
 
 def analyze_with_gpt(transcription, prompt):
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        temperature=0,
-        messages=[
+    return llm.chat(
+        [
             {
                 "role": "system",
                 "content": "You are a highly skilled AI trained in language comprehension and summarization. Please follow the user's prompt to analyze the transcription."
@@ -97,34 +356,32 @@ def analyze_with_gpt(transcription, prompt):
                 "role": "user",
                 "content": f"{prompt}\n\nTranscript:\n{transcription}"
             }
-        ]
+        ],
+        model=ANALYSIS_MODELS["GPT-4"],
+        temperature=0,
+        tool='whisper',
     )
-    return response.choices[0].message.content 
 
 def analyze_with_claude(transcription, prompt):
-    response = anthropic_client.messages.create(
-        model="claude-3-5-sonnet-20240620",
-        max_tokens=1000,
-        temperature=0,
-        messages=[
+    return llm.chat(
+        [
             {
                 "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": f"{prompt}\n\nTranskript:\n{transcription}"
-                    }
-                ]
+                "content": f"{prompt}\n\nTranskript:\n{transcription}"
             }
-        ]
+        ],
+        model=ANALYSIS_MODELS["Claude"],
+        max_tokens=1000,
+        temperature=0,
+        tool='whisper',
     )
-    return response.content[0].text
 
 def analyze_transcription(transcription, model, prompt):
     if model == "GPT-4":
         return analyze_with_gpt(transcription, prompt)
     elif model == "Claude":
         return analyze_with_claude(transcription, prompt)
+    raise ValueError(f"Unknown analysis model {model!r}; choose one of {', '.join(ANALYSIS_MODELS)}")
 
 def save_analysis_to_docx(analysis, filename):
     doc = Document()
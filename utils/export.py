@@ -0,0 +1,143 @@
+import datetime
+import os
+import tempfile
+
+import pandas as pd
+import streamlit as st
+import xlsxwriter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is hidden without pyarrow
+    pa = None
+
+EXPORT_FORMATS = {
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/octet-stream'),
+}
+
+
+def available_formats():
+    return [name for name in EXPORT_FORMATS if name != 'Parquet' or pa is not None]
+
+def _chunks(table):
+    # A table is either one DataFrame or an iterable of DataFrame chunks
+    if isinstance(table, pd.DataFrame):
+        yield table
+    else:
+        yield from table
+
+def _tagged(tables):
+    # CSV and Parquet hold a single table, so several sheets become one table with a Sheet column
+    if len(tables) == 1:
+        yield from _chunks(next(iter(tables.values())))
+        return
+    for name, table in tables.items():
+        for chunk in _chunks(table):
+            yield chunk.assign(Sheet=name)
+
+# Excel's row limit per sheet, header included; xlsxwriter silently skips rows beyond it
+EXCEL_MAX_ROWS = 1_048_576
+# Excel's limit on sheet name length
+EXCEL_MAX_SHEET_NAME = 31
+
+def _continuation_name(name, part):
+    # "Bad IDs", "Bad IDs (2)", ... shortened so the suffix fits Excel's limit
+    if part == 1:
+        return name[:EXCEL_MAX_SHEET_NAME]
+    suffix = f' ({part})'
+    return name[:EXCEL_MAX_SHEET_NAME - len(suffix)] + suffix
+
+def write_xlsx(path, tables, max_rows=EXCEL_MAX_ROWS):
+    """Write each table to its own sheet in xlsxwriter's constant-memory mode.
+
+    Rows are flushed to disk as soon as the next row starts, so memory stays
+    flat regardless of the number of rows. A table longer than Excel's row
+    limit continues on further sheets ("Bad IDs (2)", ...), each with the header.
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+
+    def write_datetime(worksheet, row, col, value, cell_format=None):
+        return worksheet.write_datetime(row, col, value, cell_format or datetime_format)
+
+    def write_row(worksheet, row, values):
+        if worksheet.write_row(row, 0, values) != 0:
+            raise ValueError(f"Could not write row {row + 1} of sheet '{worksheet.name}'")
+
+    def add_sheet(name, part, header):
+        worksheet = workbook.add_worksheet(_continuation_name(name, part))
+        for datetime_type in (datetime.datetime, pd.Timestamp):
+            worksheet.add_write_handler(datetime_type, write_datetime)
+        if header is not None:
+            write_row(worksheet, 0, header)
+        return worksheet
+
+    try:
+        for name, table in tables.items():
+            part, header = 1, None
+            worksheet = add_sheet(name, part, header)
+            row = 0
+            for chunk in _chunks(table):
+                if header is None:
+                    header = [str(col) for col in chunk.columns]
+                    write_row(worksheet, 0, header)
+                    row = 1
+                # object dtype turns NumPy scalars into Python values that xlsxwriter understands
+                values = chunk.astype(object).where(chunk.notna(), None)
+                for record in values.itertuples(index=False):
+                    if row == max_rows:
+                        part += 1
+                        worksheet = add_sheet(name, part, header)
+                        row = 1
+                    write_row(worksheet, row, record)
+                    row += 1
+    finally:
+        workbook.close()
+
+def write_csv(path, tables):
+    first = True
+    for chunk in _tagged(tables):
+        chunk.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+        first = False
+
+def write_parquet(path, tables):
+    writer = None
+    try:
+        for chunk in _tagged(tables):
+            if writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(path, table.schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+WRITERS = {'xlsx': write_xlsx, 'csv': write_csv, 'parquet': write_parquet}
+
+def export_tables(tables, export_format='Excel', path=None):
+    """Write `tables` (sheet name -> DataFrame or iterable of chunks) to `path` or a new temporary file."""
+    extension, _ = EXPORT_FORMATS[export_format]
+    if path is None:
+        with tempfile.NamedTemporaryFile(suffix=f'.{extension}', delete=False) as temp_file:
+            path = temp_file.name
+    WRITERS[extension](path, tables)
+    return path
+
+def download_button(label, tables, export_format, file_name, **kwargs):
+    """Export `tables` to disk and hand the file to st.download_button.
+
+    The export never exists in memory as a second, in-process copy; Streamlit
+    reads the finished file once to serve it.
+    """
+    extension, mime = EXPORT_FORMATS[export_format]
+    path = export_tables(tables, export_format)
+    try:
+        with open(path, 'rb') as file:
+            st.download_button(label, data=file, file_name=f'{file_name}.{extension}', mime=mime, **kwargs)
+    finally:
+        os.remove(path)
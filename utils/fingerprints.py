@@ -0,0 +1,182 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.cache import CACHE_DIR
+from utils.text_utils import _lsh_rows_per_band, _mix64, minhash_signatures
+
+INDEX_DIR = os.path.join(CACHE_DIR, 'fingerprints')
+
+# About 1% false positives; these only cost a binary search in the sorted store
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+
+# Device field combinations shared by more respondents of one wave are not fingerprinted
+MAX_SHARED_DEVICES = 3
+# Open answers must be this long to fingerprint them, since short answers repeat innocently
+MIN_ANSWER_LENGTH = 20
+# Band keys are not verified against full signatures, so aim for near-verbatim copies
+ANSWER_SIMILARITY = 0.9
+
+
+def _tag(tag):
+    return _mix64(pd.util.hash_array(np.array([str(tag)], dtype=object), categorize=False))[0]
+
+def normalize_values(values):
+    """Exact text form of identifying values, the same whether a whole number was read as int, float or text.
+
+    Values are only trimmed: case and leading zeros are kept, and numbers are
+    never rounded through float64, so distinct IDs never share a fingerprint.
+    The one canonical form is that of whole numbers Excel or a column with
+    gaps stores as floats ("123.0" is "123").
+    """
+    values = pd.Series(values)
+    if values.dtype.kind == 'f':
+        # Floats only hold whole numbers exactly below 2**53; larger ones keep their float text
+        whole = (values.notna() & (values == np.round(values)) & (values.abs() < 2**53)).to_numpy()
+        text = values.astype(object).astype(str)
+        text[whole] = values[whole].astype(np.int64).astype(str)
+        return text
+    text = values.astype(object).astype(str).str.strip()
+    return text.str.replace(r'^(-?\d+)\.0+$', r'\1', regex=True)
+
+def value_fingerprints(values, tag):
+    """uint64 fingerprint of each value, salted with `tag` (usually the column name)."""
+    hashed = pd.util.hash_array(normalize_values(values).to_numpy(dtype=object), categorize=False)
+    with np.errstate(over='ignore'):
+        return _mix64(hashed ^ _tag(str(tag).strip().lower()))
+
+def row_fingerprints(frame):
+    """uint64 fingerprint of the combination of values in each row, independent of the column order."""
+    columns = sorted(frame.columns, key=str)
+    keys = np.full(len(frame), _tag('row ' + ','.join(map(str, columns))), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for col in columns:
+            keys = _mix64(keys ^ value_fingerprints(frame[col], col))
+    return keys
+
+def answer_fingerprints(normalized, similarity=ANSWER_SIMILARITY, min_length=MIN_ANSWER_LENGTH):
+    """MinHash LSH band keys of normalized open answers.
+
+    Two answers share at least one key with high probability when their trigram
+    similarity reaches `similarity`. Returns the positions of the fingerprinted
+    answers and a (positions x bands) array of keys.
+    """
+    normalized = pd.Series(normalized, dtype=object)
+    positions = np.flatnonzero((normalized.str.len() >= min_length).to_numpy())
+    signatures = minhash_signatures(normalized.iloc[positions])
+    rows, bands = _lsh_rows_per_band(signatures.shape[1], similarity)
+    keys = np.empty((len(positions), bands), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for band in range(bands):
+            key = np.full(len(positions), _tag(f'answer band {band}'), dtype=np.uint64)
+            for column in signatures[:, band * rows:(band + 1) * rows].T:
+                key = _mix64(key ^ column.astype(np.uint64))
+            keys[:, band] = key
+    return positions, keys
+
+def _bloom_positions(keys, size_bits):
+    # Double hashing: the i-th probe is h1 + i * h2 over a power-of-two bit array
+    keys = _mix64(np.asarray(keys, dtype=np.uint64))
+    h1 = keys & np.uint64(0xFFFFFFFF)
+    h2 = (keys >> np.uint64(32)) | np.uint64(1)
+    probes = np.arange(BLOOM_HASHES, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        return (h1[:, None] + probes[None, :] * h2[:, None]) & np.uint64(size_bits - 1)
+
+class FingerprintIndex:
+    """Respondent fingerprints of earlier waves, kept on disk across sessions.
+
+    The store is a sorted uint64 array of fingerprints with the wave of each
+    entry alongside, searched with binary search. A Bloom filter in front of it
+    answers most lookups of unseen respondents without touching the store. All
+    arrays are memory-mapped, so opening the index is cheap.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or INDEX_DIR
+        meta_path = os.path.join(self.directory, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                meta = json.load(file)
+            self.keys = np.load(os.path.join(self.directory, 'keys.npy'), mmap_mode='r')
+            self.wave_ids = np.load(os.path.join(self.directory, 'waves.npy'), mmap_mode='r')
+            self.bloom = np.load(os.path.join(self.directory, 'bloom.npy'), mmap_mode='r')
+        else:
+            meta = {'waves': [], 'generation': 0}
+            self.keys = np.empty(0, dtype=np.uint64)
+            self.wave_ids = np.empty(0, dtype=np.uint32)
+            self.bloom = np.zeros(1, dtype=np.uint8)
+        self.waves = meta['waves']
+        self.generation = meta['generation']
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _may_contain(self, keys):
+        positions = _bloom_positions(keys, len(self.bloom) * 8)
+        bits = (self.bloom[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+    def lookup(self, keys, exclude_wave=None):
+        """All stored entries equal to `keys`.
+
+        Returns the position in `keys` and the wave label of every match, leaving
+        out entries of `exclude_wave` (the wave being checked itself).
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        candidates = np.flatnonzero(self._may_contain(keys)) if len(self) else np.empty(0, dtype=np.int64)
+        low = np.searchsorted(self.keys, keys[candidates], side='left')
+        counts = np.searchsorted(self.keys, keys[candidates], side='right') - low
+        owners = np.repeat(candidates, counts)
+        # Expand every [low, low + count) range into the positions it covers
+        entries = np.repeat(low - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        wave_ids = np.asarray(self.wave_ids[entries])
+        if exclude_wave in self.waves:
+            keep = wave_ids != self.waves.index(exclude_wave)
+            owners, wave_ids = owners[keep], wave_ids[keep]
+        return owners, np.array(self.waves, dtype=object)[wave_ids] if len(wave_ids) else np.empty(0, dtype=object)
+
+    def matches(self, keys, exclude_wave=None):
+        owners, _ = self.lookup(keys, exclude_wave)
+        matched = np.zeros(len(keys), dtype=bool)
+        matched[owners] = True
+        return matched
+
+    def add(self, keys, wave):
+        """Store the fingerprints of `wave`, replacing whatever was stored for that label before."""
+        keys = np.unique(np.asarray(keys, dtype=np.uint64))
+        waves = list(self.waves)
+        if wave in waves:
+            wave_id = waves.index(wave)
+            keep = np.asarray(self.wave_ids) != wave_id
+        else:
+            wave_id = len(waves)
+            waves.append(wave)
+            keep = slice(None)
+        all_keys = np.concatenate([np.asarray(self.keys)[keep], keys])
+        all_waves = np.concatenate([np.asarray(self.wave_ids)[keep], np.full(len(keys), wave_id, dtype=np.uint32)])
+        order = np.argsort(all_keys, kind='stable')
+        all_keys, all_waves = all_keys[order], all_waves[order]
+
+        size_bits = 1 << max(int(np.ceil(np.log2(max(len(all_keys), 1) * BLOOM_BITS_PER_KEY))), 3)
+        bits = np.zeros(size_bits, dtype=bool)
+        bits[_bloom_positions(all_keys, size_bits).ravel()] = True
+        bloom = np.packbits(bits, bitorder='little')
+
+        # Arrays are replaced one by one with the metadata last; a reader opening the
+        # index during an update may briefly see the new arrays with the old labels
+        os.makedirs(self.directory, exist_ok=True)
+        for name, array in (('keys', all_keys), ('waves', all_waves), ('bloom', bloom)):
+            path = os.path.join(self.directory, f'{name}.npy')
+            temp_path = f'{path}.{os.getpid()}.tmp.npy'
+            np.save(temp_path, array)
+            os.replace(temp_path, path)
+        meta_path = os.path.join(self.directory, 'meta.json')
+        with open(f'{meta_path}.{os.getpid()}.tmp', 'w') as file:
+            json.dump({'waves': waves, 'generation': self.generation + 1}, file)
+        os.replace(f'{meta_path}.{os.getpid()}.tmp', meta_path)
+        self.__init__(self.directory)
+        return len(keys)
@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+
+from utils.cache import CACHE_DIR, content_hash, params_key
+
+JOBS_DIR = os.path.join(CACHE_DIR, 'autocode_jobs')
+
+
+def job_id(data_key, column, schema, model):
+    """ID of a classification job; coding the same column of the same file with the same schema and model resumes it."""
+    return content_hash(params_key([data_key, column, schema, model]).encode())[:16]
+
+class Checkpoint:
+    """Append-only JSON Lines record of the classifications a job has completed.
+
+    Every record holds a normalized answer text, its classification and whether
+    the LLM or the local coder produced it. Records are flushed to disk as
+    they arrive, so a crash loses at most the batches still in flight; a line
+    cut short by a crash is ignored when loading.
+    """
+
+    def __init__(self, job, directory=None):
+        self.job = job
+        self.path = os.path.join(directory or JOBS_DIR, f'{job}.jsonl')
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Completed classifications by normalized text, as {'classification': ..., 'source': ...} records."""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record['key']] = {'classification': record['classification'], 'source': record['source']}
+        return records
+
+    def append(self, classifications, source):
+        """Record a dict of normalized text -> classification."""
+        if not classifications:
+            return
+        lines = ''.join(
+            json.dumps({'key': key, 'classification': classification, 'source': source}, ensure_ascii=False) + '\n'
+            for key, classification in classifications.items()
+        )
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if self._ends_mid_line():
+                # Start after the line a crash cut short instead of running on from it
+                lines = '\n' + lines
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(lines)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _ends_mid_line(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return False
+        with open(self.path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) != b'\n'
+
+    def clear(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+
+import anthropic
+import httpx
+import openai
+
+from utils.rate_limit import call_with_retries, is_retryable, retry_state
+from utils.telemetry import record_call
+
+# Unset means the providers' public APIs; point them at a local stub to test without real calls
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL') or None
+# Seconds one request may take before it counts as failed and is retried
+TIMEOUT = float(os.getenv('MIIOS_LLM_TIMEOUT', '120'))
+TRANSCRIPTION_TIMEOUT = float(os.getenv('MIIOS_TRANSCRIPTION_TIMEOUT', '900'))
+MAX_RETRIES = int(os.getenv('MIIOS_LLM_RETRIES', '3'))
+# Open connections per provider, enough for the parallel workers of autoCODE
+MAX_CONNECTIONS = int(os.getenv('MIIOS_LLM_CONNECTIONS', '64'))
+
+GPT_MODEL = "gpt-4o"
+CLAUDE_MODEL = "claude-3-5-sonnet-20240620"
+# The model a call moves to when its own provider keeps failing
+FAILOVER = {GPT_MODEL: CLAUDE_MODEL, CLAUDE_MODEL: GPT_MODEL}
+# Claude requires a completion limit on every call
+CLAUDE_MAX_TOKENS = 4096
+
+API_KEYS = {'openai': 'OPENAI_API_KEY', 'anthropic': 'ANTHROPIC_API_KEY'}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def provider(model):
+    return 'anthropic' if model.startswith('claude') else 'openai'
+
+def _mark_sent(request):
+    request.extensions['sent_at'] = time.perf_counter()
+
+def _mark_first_byte(response):
+    # Response hooks run once the headers are in, before the body is read
+    sent_at = response.request.extensions.get('sent_at')
+    if sent_at is not None:
+        response.extensions['ttfb'] = time.perf_counter() - sent_at
+
+def _client(name):
+    # One client per provider and process, created on first use; its connection pool is
+    # shared by every tool, Streamlit rerun and worker thread. The gateway retries itself.
+    with _clients_lock:
+        if name not in _clients:
+            http_client = httpx.Client(
+                timeout=TIMEOUT,
+                event_hooks={'request': [_mark_sent], 'response': [_mark_first_byte]},
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+            )
+            if name == 'openai':
+                _clients[name] = openai.OpenAI(base_url=OPENAI_BASE_URL, timeout=TIMEOUT, max_retries=0, http_client=http_client)
+            else:
+                _clients[name] = anthropic.Anthropic(base_url=ANTHROPIC_BASE_URL, timeout=TIMEOUT, max_retries=0, http_client=http_client)
+        return _clients[name]
+
+def openai_client(max_retries=MAX_RETRIES):
+    """The pooled OpenAI client for APIs the gateway does not wrap, such as assistants; the SDK retries those."""
+    return _client('openai').with_options(max_retries=max_retries)
+
+def _json_object(text):
+    # Claude has no JSON mode and may put a sentence around the object
+    start, end = text.find('{'), text.rfind('}')
+    return text[start:end + 1] if start != -1 and end > start else text
+
+def _send(model, messages, temperature, json, max_tokens, timeout):
+    # Text of the completion with its token usage and time to first byte
+    if provider(model) == 'openai':
+        options = {'response_format': {"type": "json_object"}} if json else {}
+        if max_tokens:
+            options['max_tokens'] = max_tokens
+        raw = _client('openai').chat.completions.with_raw_response.create(
+            model=model, messages=messages, temperature=temperature, timeout=timeout, **options,
+        )
+        response = raw.parse()
+        usage = response.usage
+        return {
+            'text': response.choices[0].message.content,
+            'prompt_tokens': usage.prompt_tokens if usage else 0,
+            'completion_tokens': usage.completion_tokens if usage else 0,
+            'ttfb': raw.http_response.extensions.get('ttfb'),
+        }
+    # Anthropic takes the system prompt separately
+    system = "\n\n".join(message['content'] for message in messages if message['role'] == 'system')
+    if json:
+        system = f"{system}\n\nRespond with a single JSON object and nothing else.".strip()
+    raw = _client('anthropic').messages.with_raw_response.create(
+        model=model,
+        max_tokens=max_tokens or CLAUDE_MAX_TOKENS,
+        temperature=temperature,
+        system=system or anthropic.NOT_GIVEN,
+        messages=[message for message in messages if message['role'] != 'system'],
+        timeout=timeout,
+    )
+    response = raw.parse()
+    text = response.content[0].text
+    return {
+        'text': _json_object(text) if json else text,
+        'prompt_tokens': response.usage.input_tokens,
+        'completion_tokens': response.usage.output_tokens,
+        'ttfb': raw.http_response.extensions.get('ttfb'),
+    }
+
+def _call(tool, model, send, max_retries, fallback=None):
+    # Runs `send(model)` with retries and optional failover and logs the call as a whole:
+    # wall time includes retries and backoff, tokens and TTFB are those of the answer.
+    # Callers that retry the gateway themselves (autoCODE's run_concurrent) make one
+    # logical call of several attempts, which is logged once, when it is settled.
+    outer = retry_state()
+    attempts = []
+
+    def attempt(model):
+        attempts.append(model)
+        return send(model)
+
+    if outer is None:
+        earlier_attempts, started, start = 0, time.time(), time.perf_counter()
+    else:
+        earlier_attempts, _, started, start = outer
+    try:
+        try:
+            result = call_with_retries(attempt, model, None, 0, max_retries)
+        except Exception as e:
+            if fallback is None or not is_retryable(e) or not os.getenv(API_KEYS[provider(fallback)]):
+                raise
+            result = call_with_retries(attempt, fallback, None, 0, max_retries)
+    except Exception as e:
+        if outer is not None and is_retryable(e) and outer[0] < outer[1]:
+            # The caller tries again; that attempt logs the call
+            raise
+        record_call(tool, attempts[-1] if attempts else model, started, time.perf_counter() - start,
+                    retries=earlier_attempts + max(len(attempts) - 1, 0), failover=attempts[-1:] != [model], error=e)
+        raise
+    record_call(tool, attempts[-1], started, time.perf_counter() - start, result['prompt_tokens'], result['completion_tokens'],
+                result['ttfb'], retries=earlier_attempts + len(attempts) - 1, failover=attempts[-1] != model)
+    return result['text']
+
+def chat(messages, model=GPT_MODEL, temperature=0, json=False, max_tokens=None, timeout=TIMEOUT, max_retries=None, failover=True, tool=None):
+    """Text of a chat completion of OpenAI-style `messages`, from GPT or Claude alike.
+
+    Timeouts, 429s, 5xx and connection errors are retried with jittered
+    backoff. If they persist and `failover` is set, the paired model of the
+    other provider answers instead, provided its API key is configured. Safe
+    to call from many threads at once. Every call is logged to the telemetry
+    log under `tool`.
+    """
+    def send(model):
+        return _send(model, messages, temperature, json, max_tokens, timeout)
+
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    return _call(tool, model, send, max_retries, FAILOVER.get(model) if failover else None)
+
+def transcribe(audio_file_path, model="whisper-1", timeout=TRANSCRIPTION_TIMEOUT, max_retries=None, tool=None):
+    """Text of an audio file transcribed by OpenAI."""
+    def send(model):
+        with open(audio_file_path, 'rb') as audio_file:
+            raw = _client('openai').audio.transcriptions.with_raw_response.create(file=audio_file, model=model, timeout=timeout)
+        return {'text': raw.parse().text, 'prompt_tokens': 0, 'completion_tokens': 0, 'ttfb': raw.http_response.extensions.get('ttfb')}
+
+    return _call(tool, model, send, MAX_RETRIES if max_retries is None else max_retries)
@@ -0,0 +1,286 @@
+import base64
+import glob
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from utils.cache import CACHE_DIR, content_hash
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Sidecars are skipped without pyarrow
+    pq = None
+
+# Sidecars are copies of uploads; beyond this total the least recently used ones are deleted
+MAX_SIDECAR_BYTES = int(os.getenv('MIIOS_SIDECAR_MB', '4096')) * 2**20
+# Sidecar metadata listing the columns of text and numbers stored as text, with a bitmask of the numbers
+MIXED_COLUMNS_KEY = b'miios_mixed_columns'
+NUMBER_TYPES = (int, float, np.integer, np.floating)
+
+# Data keys whose tables could not be stored as Parquet; they are parsed without trying again
+_unconvertible = set()
+
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = 'openpyxl'
+
+
+def _rewind(source):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+def is_excel(source):
+    name = getattr(source, 'name', source)
+    return str(name).endswith('.xlsx')
+
+def _excel_value(value):
+    # Mirror pd.read_excel, which turns whole-number floats back into ints
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _none_to_nan(frame):
+    # Missing text comes back as None from openpyxl and Parquet but as NaN from the
+    # pandas readers, and the checks' missing codes only list np.nan
+    for col in frame.columns[frame.dtypes == object]:
+        frame[col] = frame[col].where(frame[col].notna(), np.nan)
+    return frame
+
+def _excel_frame(rows, columns, dtype):
+    frame = pd.DataFrame(rows, columns=columns)
+    frame = _none_to_nan(frame).infer_objects()
+    if dtype is str:
+        frame = frame.apply(lambda col: col.map(str, na_action='ignore').astype(object))
+    return frame
+
+def _iter_excel_chunks(source, chunksize, usecols, dtype):
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        positions = range(len(header)) if usecols is None else [header.index(col) for col in usecols]
+        columns = [header[i] for i in positions]
+        batch = []
+        for row in rows:
+            batch.append([_excel_value(row[i]) if i < len(row) else None for i in positions])
+            if len(batch) == chunksize:
+                yield _excel_frame(batch, columns, dtype)
+                batch = []
+        if batch:
+            yield _excel_frame(batch, columns, dtype)
+    finally:
+        workbook.close()
+
+def iter_chunks(source, chunksize=100_000, usecols=None, dtype=None):
+    """Yield the first sheet of an XLSX file or a CSV file as DataFrames of at most `chunksize` rows."""
+    _rewind(source)
+    if is_excel(source):
+        yield from _iter_excel_chunks(source, chunksize, usecols, dtype)
+    else:
+        with pd.read_csv(source, chunksize=chunksize, usecols=usecols, dtype=dtype) as reader:
+            yield from reader
+
+def reservoir_sample(chunks, size, seed=0):
+    """Uniform random sample of at most `size` rows from an iterable of DataFrame chunks, in one pass.
+
+    Every row draws a random priority and the rows with the lowest priorities
+    are kept (bottom-k reservoir sampling), so memory stays at one chunk plus
+    the sample. Rows keep their original order.
+    """
+    rng = np.random.default_rng(seed)
+    sample, priorities = None, np.empty(0)
+    for chunk in chunks:
+        sample = chunk if sample is None else pd.concat([sample, chunk])
+        priorities = np.concatenate([priorities, rng.random(len(chunk))])
+        if len(priorities) > size:
+            keep = np.sort(np.argpartition(priorities, size)[:size])
+            sample, priorities = sample.iloc[keep], priorities[keep]
+    return sample
+
+def read_header(source, data_key=None):
+    if pq is not None and data_key and os.path.exists(sidecar_path(data_key)):
+        return pq.read_schema(sidecar_path(data_key)).names
+    _rewind(source)
+    if is_excel(source):
+        workbook = load_workbook(source, read_only=True)
+        try:
+            header = next(workbook.worksheets[0].iter_rows(values_only=True), ())
+        finally:
+            workbook.close()
+        return list(header)
+    return pd.read_csv(source, nrows=0).columns.tolist()
+
+def compact_dtypes(df, category_ratio=0.5):
+    """Shrink a freshly loaded survey frame without changing any value.
+
+    Integer codes become the smallest signed integer type, whole-number floats
+    become integers (or float32 when they contain NaN and stay exactly
+    representable), and text columns with repeated labels become categoricals.
+    """
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_bool_dtype(values):
+            continue
+        if pd.api.types.is_integer_dtype(values):
+            df[col] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values):
+            numbers = values.dropna()
+            if len(numbers) and (numbers == np.round(numbers)).all() and numbers.abs().max() < 2**24:
+                if len(numbers) == len(values):
+                    df[col] = pd.to_numeric(values.astype(np.int64), downcast='integer')
+                else:
+                    df[col] = values.astype(np.float32)
+        elif values.dtype == object and len(values):
+            labels = values.dropna()
+            if labels.map(type).eq(str).all() and labels.nunique() <= category_ratio * len(values):
+                df[col] = values.astype('category')
+    return df
+
+def source_key(source):
+    """Content hash of an upload (anything with getvalue()) or a file on disk."""
+    if hasattr(source, 'getvalue'):
+        return content_hash(source.getvalue())
+    digest = hashlib.sha256()
+    with open(source, 'rb') as file:
+        for block in iter(lambda: file.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def sidecar_path(data_key):
+    return os.path.join(CACHE_DIR, f'{data_key}.parquet')
+
+def _evict_sidecars(keep, max_bytes=None):
+    max_bytes = MAX_SIDECAR_BYTES if max_bytes is None else max_bytes
+    sidecars = []
+    for path in glob.glob(os.path.join(CACHE_DIR, '*.parquet')):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        sidecars.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in sidecars)
+    for _, size, path in sorted(sidecars):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+def _is_number(value):
+    return isinstance(value, NUMBER_TYPES) and not isinstance(value, (bool, np.bool_))
+
+def _sidecar_table(df):
+    # Parquet columns hold one type, but Excel open answers mix text with numeric missing
+    # codes ('gut', -99, 'teuer'). Those columns are stored as text and the cells that
+    # were numbers are marked, so reading the sidecar gives back the same values
+    frame, mixed = df, {}
+    for col in df.columns[df.dtypes == object]:
+        values = df[col]
+        if not pd.api.types.infer_dtype(values, skipna=True).startswith('mixed'):
+            continue
+        present = values.notna().to_numpy()
+        numbers = values.map(_is_number).to_numpy(dtype=bool) & present
+        text = values.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+        if numbers.any() and text.any() and (numbers | text | ~present).all():
+            if frame is df:
+                frame = df.copy()
+            frame[col] = values.map(str, na_action='ignore')
+            mixed[str(col)] = base64.b64encode(np.packbits(numbers).tobytes()).decode()
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    if mixed:
+        table = table.replace_schema_metadata({**table.schema.metadata, MIXED_COLUMNS_KEY: json.dumps(mixed).encode()})
+    return table
+
+def _number(text):
+    return int(text) if text.lstrip('-').isdigit() else float(text)
+
+def _restore_mixed(frame, metadata):
+    # Undo _sidecar_table for the first len(frame) rows of the sidecar
+    mixed = json.loads((metadata or {}).get(MIXED_COLUMNS_KEY, b'{}'))
+    for col in frame.columns:
+        if str(col) in mixed:
+            bits = np.frombuffer(base64.b64decode(mixed[str(col)]), dtype=np.uint8)
+            numbers = np.unpackbits(bits)[:len(frame)].astype(bool)
+            values = frame[col].to_numpy(dtype=object).copy()
+            values[numbers] = [_number(text) for text in values[numbers]]
+            frame[col] = values
+    return frame
+
+def _write_sidecar(df, data_key):
+    if pq is None:
+        return
+    path = sidecar_path(data_key)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        pq.write_table(_sidecar_table(df), temp_path)
+        os.replace(temp_path, path)
+    except (TypeError, ValueError, OSError, ImportError) as e:
+        # Columns Parquet cannot store (text mixed with dates, say) leave the file without a
+        # sidecar; it is parsed on every load, but the conversion is not tried again
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        _unconvertible.add(data_key)
+        warnings.warn(f"Skipping Parquet sidecar: {e}")
+        return
+    _evict_sidecars(keep=path)
+
+def _touch(path):
+    # Sidecars are evicted by modification time, so reading one marks it as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def _parse(source, usecols=None, nrows=None):
+    _rewind(source)
+    if is_excel(source):
+        return pd.read_excel(source, engine=EXCEL_ENGINE, usecols=usecols, nrows=nrows)
+    return pd.read_csv(source, usecols=usecols, nrows=nrows)
+
+def read_table(source, usecols=None, data_key=None, sidecar=True):
+    """Load a CSV/XLSX file with compact dtypes, going through a Parquet sidecar keyed on the file content.
+
+    The first full load converts the file once; later loads, including column
+    subsets, read the memory-mapped sidecar instead of parsing the file again.
+    Pass `sidecar=False` for one-off reads that should not leave a sidecar behind.
+    """
+    if not sidecar:
+        return compact_dtypes(_parse(source, usecols=usecols))
+    data_key = data_key or source_key(source)
+    if data_key in _unconvertible:
+        return compact_dtypes(_parse(source, usecols=usecols))
+    path = sidecar_path(data_key)
+    if pq is not None and os.path.exists(path):
+        _touch(path)
+        frame = pd.read_parquet(path, columns=usecols, memory_map=True)
+        return _none_to_nan(_restore_mixed(frame, pq.read_schema(path).metadata))
+    if pq is None and usecols is not None:
+        return compact_dtypes(_parse(source, usecols=usecols))
+    df = compact_dtypes(_parse(source))
+    _write_sidecar(df, data_key)
+    return df if usecols is None else df[usecols]
+
+def read_preview(source, nrows=5, data_key=None):
+    path = sidecar_path(data_key) if data_key else None
+    if pq is not None and path and os.path.exists(path):
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        batch = next(parquet_file.iter_batches(batch_size=nrows), None)
+        if batch is not None:
+            return _none_to_nan(_restore_mixed(batch.to_pandas(), parquet_file.schema_arrow.metadata))
+    if is_excel(source):
+        # The streaming reader stops after the first rows instead of loading the sheet
+        return next(iter_chunks(source, chunksize=nrows), pd.DataFrame(columns=read_header(source)))
+    return _parse(source, nrows=nrows)
@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import anthropic
+import openai
+
+# Rough size of a prompt in tokens, good enough for budgeting against tokens-per-minute limits
+CHARS_PER_TOKEN = 4
+
+RETRY_STATUS_CODES = {408, 409, 429}
+
+
+def estimate_tokens(text, completion_tokens=0):
+    return len(text) // CHARS_PER_TOKEN + 1 + completion_tokens
+
+def pack_batches(items, cost, token_budget, max_items=None):
+    """Split `items` into consecutive batches whose summed `cost` stays within `token_budget`.
+
+    An item that alone exceeds the budget gets a batch of its own.
+    """
+    batches, batch, used = [], [], 0
+    for item in items:
+        tokens = cost(item)
+        if batch and (used + tokens > token_budget or len(batch) == max_items):
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append(item)
+        used += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `per_minute` with room for a burst of `capacity`.
+
+    Callers reserve what they need up front and sleep for the returned delay,
+    so waiting callers are served in the order they asked.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60
+        self.capacity = capacity or max(per_minute / 10, 1)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= amount
+            return max(-self.level / self.rate, 0)
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits shared by all workers."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.resume_at = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        time.sleep(max(wait, self.resume_at - time.monotonic(), 0))
+
+    def pause(self, seconds):
+        # A 429 means the server-side budget is spent, so every worker backs off, not just the one that hit it
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+def is_retryable(error):
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, anthropic.APIConnectionError, anthropic.APITimeoutError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status in RETRY_STATUS_CODES or (status is not None and status >= 500)
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+# The retry loop running on each thread, so a call made inside it can tell which attempt it is
+_retry_state = threading.local()
+
+def retry_state():
+    """(attempt, max_retries, start time, start perf_counter) of the call_with_retries loop on this thread, or None."""
+    return getattr(_retry_state, 'current', None)
+
+def call_with_retries(func, item, limiter, tokens, max_retries=5, base_delay=1.0, max_delay=60.0):
+    """Call `func(item)` within the rate limits, retrying 429/5xx and connection errors with jittered exponential backoff.
+
+    Without a `limiter` the call is only retried, as the LLM gateway does for single calls.
+    """
+    outer = retry_state()
+    started, start = time.time(), time.perf_counter()
+    try:
+        for attempt in range(max_retries + 1):
+            _retry_state.current = (attempt, max_retries, started, start)
+            if limiter is not None:
+                limiter.acquire(tokens)
+            try:
+                return func(item)
+            except Exception as e:
+                if attempt == max_retries or not is_retryable(e):
+                    raise
+                delay = _retry_after(e) or min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+                if limiter is not None and getattr(e, 'status_code', None) == 429:
+                    limiter.pause(delay)
+                time.sleep(delay)
+    finally:
+        _retry_state.current = outer
+
+def run_concurrent(func, items, workers=8, requests_per_minute=500, tokens_per_minute=30_000, cost=None, max_retries=5, on_progress=None, on_result=None):
+    """Apply `func` to every item on a thread pool within rate limits, keeping the input order.
+
+    `cost(item)` estimates the tokens of one call. Returns the results and a
+    dict of the errors of calls that failed for good, both by item position.
+    `on_result(position, result)` after each successful call and
+    `on_progress(done, total)` after each completed call are called from the
+    calling thread, so they may update Streamlit elements.
+    """
+    items = list(items)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    results = [None] * len(items)
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(call_with_retries, func, item, limiter, cost(item) if cost else 1, max_retries): position
+            for position, item in enumerate(items)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            position = futures[future]
+            try:
+                results[position] = future.result()
+            except Exception as e:
+                errors[position] = e
+            else:
+                if on_result:
+                    on_result(position, results[position])
+            if on_progress:
+                on_progress(done, len(items))
+    return results, errors
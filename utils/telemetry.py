@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils.cache import CACHE_DIR
+
+# Append-only JSON Lines log of every model call; an empty MIIOS_TELEMETRY_PATH turns logging off
+TELEMETRY_PATH = os.getenv('MIIOS_TELEMETRY_PATH', os.path.join(CACHE_DIR, 'llm_calls.jsonl'))
+
+# List prices in USD per million prompt and completion tokens; update them when the providers do
+PRICES = {
+    'gpt-4o': (5.00, 15.00),
+    'claude-3-5-sonnet-20240620': (3.00, 15.00),
+}
+
+_lock = threading.Lock()
+
+
+def record_call(tool, model, started, wall_time, prompt_tokens=0, completion_tokens=0, ttfb=None, retries=0, failover=False, error=None, path=None):
+    """Append one model call to the telemetry log; logging never breaks the call itself."""
+    path = TELEMETRY_PATH if path is None else path
+    if not path:
+        return
+    line = json.dumps({
+        'time': started,
+        'tool': tool or 'other',
+        'model': model,
+        'prompt_tokens': prompt_tokens or 0,
+        'completion_tokens': completion_tokens or 0,
+        'wall_time': round(wall_time, 4),
+        'ttfb': None if ttfb is None else round(ttfb, 4),
+        'retries': retries,
+        'failover': failover,
+        'error': None if error is None else type(error).__name__,
+    }) + '\n'
+    try:
+        with _lock:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as file:
+                file.write(line)
+    except OSError:
+        pass
+
+def read_calls(path=None, since=None):
+    """The logged calls as a DataFrame, optionally only those started after the `since` timestamp."""
+    path = TELEMETRY_PATH if path is None else path
+    records = []
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    calls = pd.DataFrame(records, columns=['time', 'tool', 'model', 'prompt_tokens', 'completion_tokens', 'wall_time', 'ttfb', 'retries', 'failover', 'error'])
+    calls['ttfb'] = pd.to_numeric(calls['ttfb'])
+    if since is not None:
+        calls = calls[calls['time'] >= since]
+    return calls
+
+def call_costs(calls):
+    """Estimated USD cost of each call at list prices; NaN for models without a price."""
+    prices = calls['model'].map(PRICES)
+    prompt_price = prices.map(lambda price: price[0] if isinstance(price, tuple) else np.nan)
+    completion_price = prices.map(lambda price: price[1] if isinstance(price, tuple) else np.nan)
+    return (calls['prompt_tokens'] * prompt_price + calls['completion_tokens'] * completion_price) / 1e6
+
+def summarize_calls(calls, by='tool'):
+    """Latency percentiles, throughput, token totals and cost per group of calls.
+
+    Throughput is calls and tokens per minute between the first and the last
+    call of a group, so it reflects how fast a tool got through its work.
+    """
+    calls = calls.assign(
+        tokens=calls['prompt_tokens'] + calls['completion_tokens'],
+        cost=call_costs(calls),
+        failed=calls['error'].notna(),
+        end=calls['time'] + calls['wall_time'],
+    )
+    groups = calls.groupby(by)
+    minutes = ((groups['end'].max() - groups['time'].min()) / 60).clip(lower=1 / 60)
+    summary = pd.DataFrame({
+        'calls': groups.size(),
+        'failed': groups['failed'].sum(),
+        'retries': groups['retries'].sum(),
+        'p50_seconds': groups['wall_time'].quantile(0.5),
+        'p95_seconds': groups['wall_time'].quantile(0.95),
+        'p50_ttfb_seconds': groups['ttfb'].quantile(0.5),
+        'calls_per_minute': groups.size() / minutes,
+        'tokens_per_minute': groups['tokens'].sum() / minutes,
+        'prompt_tokens': groups['prompt_tokens'].sum(),
+        'completion_tokens': groups['completion_tokens'].sum(),
+        'cost_usd': groups['cost'].sum(min_count=1),
+    })
+    return summary.sort_values('calls', ascending=False)
@@ -0,0 +1,235 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+NGRAM_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+# Mean trigram log-probability below which an answer counts as gibberish
+GIBBERISH_THRESHOLD = -3.5
+
+
+def encode_texts(texts):
+    """Concatenate `texts` into one array of Unicode code points.
+
+    Returns the code points and the start offset of every text, so per-text
+    results can be computed with one vectorized pass over all of them.
+    """
+    texts = pd.Series(texts, dtype=object).astype(str)
+    lengths = texts.str.len().to_numpy()
+    joined = ''.join(texts.tolist())
+    codes = np.frombuffer(joined.encode('utf-32-le'), dtype=np.uint32)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    return codes, starts, lengths
+
+@lru_cache(maxsize=None)
+def load_ngram_model(language):
+    """Character trigram table for `language` ('en' or 'de') shipped in data/.
+
+    Symbol 0 is the word boundary; letters of the model's alphabet are 1..V-1.
+    """
+    tables = np.load(os.path.join(NGRAM_DIR, f'ngrams_{language}.npz'))
+    alphabet = str(tables['alphabet'])
+    log_probs = tables['log_probs'].astype(np.float32)
+    lookup = np.zeros(max(map(ord, alphabet)) + 1, dtype=np.int64)
+    for i, char in enumerate(alphabet, start=1):
+        lookup[ord(char)] = i
+    return lookup, log_probs, len(alphabet) + 1
+
+def _symbols(codes, lookup):
+    # Everything outside the alphabet (digits, punctuation, spaces) is a word boundary
+    inside = codes < len(lookup)
+    return np.where(inside, lookup[np.where(inside, codes, 0)], 0)
+
+def ngram_scores(texts, language='en', min_ngrams=3, block_size=100_000):
+    """Mean character trigram log-probability of each text under the language model.
+
+    Trigrams are taken within words only. Texts with fewer than `min_ngrams`
+    trigrams get NaN, because there is too little text to judge.
+    """
+    lookup, log_probs, size = load_ngram_model(language)
+    texts = pd.Series(texts, dtype=object)
+    scores = np.full(len(texts), np.nan)
+    for block_start in range(0, len(texts), block_size):
+        block = texts.iloc[block_start:block_start + block_size]
+        # Pad every text with boundaries so trigrams never span two texts
+        codes, starts, lengths = encode_texts(' ' + block.astype(str).str.lower() + ' ')
+        symbols = _symbols(codes, lookup)
+        if len(symbols) < 3:
+            continue
+        trigrams = symbols[:-2] * size * size + symbols[1:-1] * size + symbols[2:]
+        text_ids = np.repeat(np.arange(len(block)), lengths)[:-2]
+        ends = (starts + lengths)[text_ids]
+        valid = (np.arange(len(trigrams)) + 3 <= ends) & (symbols[1:-1] != 0)
+        counts = np.bincount(text_ids[valid], minlength=len(block))
+        totals = np.bincount(text_ids[valid], weights=log_probs[trigrams[valid]], minlength=len(block))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            block_scores = totals / counts
+        block_scores[counts < min_ngrams] = np.nan
+        scores[block_start:block_start + len(block)] = block_scores
+    return scores
+
+def repetitive_texts(texts, min_letters=4, min_run=3, max_distinct=2, distinct_min_letters=6):
+    """Whether each text is a repeated-character mash such as "xxxxxxxx" or "hahahaha".
+
+    Trigram scores rate these as natural text, since runs like "aa" or "ha"
+    are common. Only letters count, case-insensitively. A text is repetitive
+    if one run of at least `min_run` same letters makes up at least half of
+    its (at least `min_letters`) letters, or if it has `distinct_min_letters`
+    letters or more but no more than `max_distinct` distinct ones. Double
+    letters are ordinary spelling ("good", "Anna"), so they never count as a run.
+    """
+    letters = pd.Series(texts, dtype=object).astype(str).str.lower().str.replace(r'[\W\d_]+', '', regex=True)
+    codes, starts, lengths = encode_texts(letters)
+    text_ids = np.repeat(np.arange(len(lengths)), lengths)
+    # Runs of the same letter within one text
+    new_run = np.ones(len(codes), dtype=bool)
+    new_run[1:] = (codes[1:] != codes[:-1]) | (text_ids[1:] != text_ids[:-1])
+    run_ids = np.cumsum(new_run) - 1
+    run_lengths = np.bincount(run_ids, minlength=new_run.sum())
+    longest_run = np.zeros(len(lengths), dtype=np.int64)
+    np.maximum.at(longest_run, text_ids[new_run], run_lengths)
+    distinct_pairs = np.unique(text_ids.astype(np.uint64) << np.uint64(21) | codes.astype(np.uint64))
+    distinct = np.bincount((distinct_pairs >> np.uint64(21)).astype(np.int64), minlength=len(lengths))
+    return ((lengths >= min_letters) & (longest_run >= min_run) & (2 * longest_run >= lengths)) | ((lengths >= distinct_min_letters) & (distinct <= max_distinct))
+
+def normalize_texts(texts):
+    """Lowercase, drop punctuation and collapse whitespace, so trivially edited copies compare equal."""
+    texts = pd.Series(texts, dtype=object).astype(str).str.lower()
+    return texts.str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+
+def _mix64(values):
+    # splitmix64 finalizer; spreads shingle code points over all 64 bits
+    values = values.astype(np.uint64)
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xBF58476D1CE4E5B9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94D049BB133111EB)
+    values ^= values >> np.uint64(31)
+    return values
+
+def minhash_signatures(texts, num_perm=64, seed=1, block_size=20_000, perm_block=16):
+    """MinHash signature (num_perm uint32 values) of the character trigram set of each text.
+
+    Texts are expected to be normalized and non-empty. Hash functions are
+    multiply-shift hashes of the mixed trigram code, so signatures are stable
+    across processes and runs.
+    """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, 2**63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+    texts = pd.Series(texts, dtype=object)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    with np.errstate(over='ignore'):
+        for block_start in range(0, len(texts), block_size):
+            block = ' ' + texts.iloc[block_start:block_start + block_size].astype(str) + ' '
+            codes, starts, lengths = encode_texts(block)
+            codes = codes.astype(np.uint64)
+            shingles = _mix64((codes[:-2] << np.uint64(42)) | (codes[1:-1] << np.uint64(21)) | codes[2:])
+            # Every padded text has at least one trigram; drop those spanning two texts
+            text_ids = np.repeat(np.arange(len(block)), lengths)[:-2]
+            keep = np.arange(len(shingles)) + 3 <= (starts + lengths)[text_ids]
+            shingles = shingles[keep]
+            first = np.concatenate([[0], np.cumsum(np.bincount(text_ids[keep], minlength=len(block)))[:-1]])
+            for perm_start in range(0, num_perm, perm_block):
+                perms = slice(perm_start, perm_start + perm_block)
+                hashed = (multipliers[perms, None] * shingles[None, :] + offsets[perms, None]) >> np.uint64(32)
+                signatures[block_start:block_start + len(block), perms] = np.minimum.reduceat(hashed, first, axis=1).T
+    return signatures
+
+def _lsh_rows_per_band(num_perm, threshold):
+    # Aim the LSH S-curve a little below the threshold so that few true matches are
+    # missed; candidates are verified against the full signatures afterwards
+    target = max(threshold - 0.1, 0.05)
+    options = [(rows, num_perm // rows) for rows in range(1, num_perm + 1)]
+    return min(options, key=lambda option: abs((1 / option[1]) ** (1 / option[0]) - target))
+
+def _connected_components(size, left, right):
+    labels = np.arange(size)
+    while True:
+        previous = labels.copy()
+        low = np.minimum(labels[left], labels[right])
+        np.minimum.at(labels, left, low)
+        np.minimum.at(labels, right, low)
+        # Pointer jumping until every node points at its component's smallest member
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, previous):
+            return labels
+
+def lsh_components(signatures, threshold=0.8):
+    """Group signatures whose estimated Jaccard similarity is at least `threshold`.
+
+    Each band of the signatures is bucketed; every bucket member is verified
+    against the bucket's first member and matches are merged into components.
+    Returns the smallest member index of each signature's component.
+    """
+    size, num_perm = signatures.shape
+    if size == 0:
+        return np.arange(0)
+    rows, bands = _lsh_rows_per_band(num_perm, threshold)
+    left, right = [], []
+    for band in range(bands):
+        keys = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows]).view(np.dtype((np.void, 4 * rows))).ravel()
+        _, bucket = np.unique(keys, return_inverse=True)
+        order = np.argsort(bucket, kind='stable')
+        starts = np.flatnonzero(np.r_[True, bucket[order][1:] != bucket[order][:-1]])
+        representative = np.repeat(order[starts], np.diff(np.r_[starts, size]))
+        candidates = order != representative
+        members, representative = order[candidates], representative[candidates]
+        similarity = (signatures[members] == signatures[representative]).mean(axis=1)
+        matched = similarity >= threshold
+        left.append(members[matched])
+        right.append(representative[matched])
+    return _connected_components(size, np.concatenate(left), np.concatenate(right))
+
+def ngram_vectors(texts, dim=4096, ngram_sizes=(3, 4)):
+    """Hashed character n-gram counts of each text as a dense (texts x dim) float32 array, log-scaled.
+
+    Texts are padded with a space, so word starts and ends form their own
+    n-grams. The array is dense, so callers vectorize large inputs in blocks.
+    """
+    texts = ' ' + pd.Series(texts, dtype=object).astype(str) + ' '
+    codes, starts, lengths = encode_texts(texts)
+    codes = codes.astype(np.uint64)
+    text_ids = np.repeat(np.arange(len(texts)), lengths)
+    ends = starts + lengths
+    counts = np.zeros(len(texts) * dim, dtype=np.float32)
+    with np.errstate(over='ignore'):
+        for size in ngram_sizes:
+            count = len(codes) - size + 1
+            if count <= 0:
+                continue
+            hashed = np.full(count, size, dtype=np.uint64)
+            for offset in range(size):
+                hashed = _mix64((hashed << np.uint64(21)) ^ codes[offset:offset + count])
+            # Drop the n-grams spanning two texts
+            keep = np.arange(count) + size <= ends[text_ids[:count]]
+            buckets = text_ids[:count][keep] * dim + (hashed[keep] % np.uint64(dim)).astype(np.int64)
+            counts += np.bincount(buckets, minlength=len(counts)).astype(np.float32)
+    return np.log1p(counts).reshape(len(texts), dim)
+
+def stratified_sample(texts, size, strata=5, seed=0):
+    """Deterministic sample of `size` texts, stratified by length.
+
+    Texts are split into `strata` length quantiles and every stratum gives
+    its proportional share, so short stock answers and long elaborate ones
+    are both represented. The same texts always give the same sample, in
+    their original order.
+    """
+    texts = pd.Series(texts, dtype=object).dropna().reset_index(drop=True)
+    if size >= len(texts):
+        return texts.tolist()
+    lengths = texts.astype(str).str.len()
+    stratum = pd.qcut(lengths.rank(method='first'), min(strata, len(texts)), labels=False)
+    # Largest-remainder allocation keeps the total at exactly `size`
+    shares = stratum.value_counts().sort_index() * size / len(texts)
+    counts = np.floor(shares).astype(int)
+    counts[(shares - counts).sort_values(ascending=False).index[:size - counts.sum()]] += 1
+    rng = np.random.default_rng(seed)
+    chosen = np.concatenate([rng.choice(np.flatnonzero(stratum == label), count, replace=False) for label, count in counts.items()])
+    return texts.iloc[np.sort(chosen)].tolist()